@@ -1,10 +1,21 @@
 import os
+import json
 import time
+import asyncio
 import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, nullcontext
+from datetime import datetime
+from typing import List, Optional
 import gradio as gr
 from fastapi import FastAPI, HTTPException
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 import requests
+from model_router import (ModelRouter, RouteRequest, EngineError, RoutingError,
+                          HFInferenceEngine, LocalAgentEngine, MockEngine)
+from degradation import DegradationController, SemanticAnswerCache, parse_thresholds, DEGRADATION_LEVELS
 
 # Configurazione logging
 logging.basicConfig(level=logging.INFO,
@@ -16,6 +27,17 @@ class QueryRequest(BaseModel):
     query: str
     client_id: str = "default"
 
+class PrefetchRequest(BaseModel):
+    query: str
+
+class BatchQueryItem(BaseModel):
+    query: str
+    client_id: Optional[str] = None  # None = query senza cronologia
+
+class BatchQueryRequest(BaseModel):
+    queries: List[BatchQueryItem]
+    concurrency: Optional[int] = None
+
 # FastAPI app
 app = FastAPI(title="Salesforce Assistant API")
 
@@ -23,49 +45,373 @@ app = FastAPI(title="Salesforce Assistant API")
 # Mixtral è ottimo per il reasoning e supporta l'inferenza gratuita
 INFERENCE_MODEL = os.environ.get("INFERENCE_MODEL", "mistralai/Mixtral-8x7B-Instruct-v0.1")
 
+# Motori aggiuntivi per il router: modello veloce per query semplici, modello locale, mock per test
+FAST_INFERENCE_MODEL = os.environ.get("FAST_INFERENCE_MODEL", "")
+LOCAL_MODEL_PATH = os.environ.get("LOCAL_MODEL_PATH", "")
+LOCAL_AGENT_PIPELINED = os.environ.get("LOCAL_AGENT_PIPELINED", "True").lower() == "true"
+ROUTER_MOCK_ENGINE = os.environ.get("ROUTER_MOCK_ENGINE", "False").lower() == "true"
+
 # Cache per risposte recenti
 response_cache = {}
 
 # Dizionario per memorizzare la cronologia delle conversazioni
 conversation_history = {}
 
-def generate_text_with_inference_api(prompt, max_tokens=1024, temperature=0.7):
-    """Genera testo usando l'API di inferenza di Hugging Face"""
-    cache_key = f"{prompt}_{max_tokens}_{temperature}"
+# Priorità delle richieste verso il modello (valore più basso = priorità più alta)
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BATCH = 1
+
+# Configurazione della concorrenza verso l'API di inferenza
+UPSTREAM_CONCURRENCY = int(os.environ.get("UPSTREAM_CONCURRENCY", 4))
+INTERACTIVE_RESERVED_SLOTS = int(os.environ.get("INTERACTIVE_RESERVED_SLOTS", 1))
+
+# Configurazione delle query batch
+BATCH_CONCURRENCY = int(os.environ.get("BATCH_CONCURRENCY", 4))
+BATCH_MAX_CONCURRENCY = int(os.environ.get("BATCH_MAX_CONCURRENCY", 16))
+BATCH_MAX_ITEMS = int(os.environ.get("BATCH_MAX_ITEMS", 500))
+
+# Executor dedicato alle query batch: il numero di thread limita la concorrenza
+# complessiva di tutti i batch in corso, senza occupare l'executor di default
+# usato dalle richieste interattive
+batch_executor = ThreadPoolExecutor(max_workers=BATCH_MAX_CONCURRENCY, thread_name_prefix="batch")
+
+# Prefisso della cronologia delle query batch, separata da quella dei client interattivi
+BATCH_HISTORY_PREFIX = "batch:"
+
+class PriorityLimiter:
+    """Limita le chiamate concorrenti al modello dando precedenza al traffico interattivo.
+    
+    Le richieste batch non possono occupare gli slot riservati alle richieste
+    interattive e attendono finché ci sono richieste interattive in coda.
+    """
+    
+    def __init__(self, slots, reserved_slots=1):
+        self.slots = max(1, slots)
+        self.reserved_slots = min(max(0, reserved_slots), self.slots - 1)
+        self.in_use = 0
+        self.waiting = {PRIORITY_INTERACTIVE: 0, PRIORITY_BATCH: 0}
+        self._condition = threading.Condition()
+    
+    def _can_acquire(self, priority):
+        if priority == PRIORITY_INTERACTIVE:
+            return self.in_use < self.slots
+        if self.waiting[PRIORITY_INTERACTIVE] > 0:
+            return False
+        return self.in_use < self.slots - self.reserved_slots
+    
+    @contextmanager
+    def slot(self, priority=PRIORITY_INTERACTIVE):
+        with self._condition:
+            self.waiting[priority] += 1
+            while not self._can_acquire(priority):
+                self._condition.wait()
+            self.waiting[priority] -= 1
+            self.in_use += 1
+        try:
+            yield
+        finally:
+            with self._condition:
+                self.in_use -= 1
+                self._condition.notify_all()
+    
+    def stats(self):
+        return {
+            "slots": self.slots,
+            "in_use": self.in_use,
+            "waiting_interactive": self.waiting[PRIORITY_INTERACTIVE],
+            "waiting_batch": self.waiting[PRIORITY_BATCH]
+        }
+
+upstream_limiter = PriorityLimiter(UPSTREAM_CONCURRENCY, INTERACTIVE_RESERVED_SLOTS)
+
+# Configurazione del riscaldamento del modello (cold start dell'API di inferenza)
+MODEL_WARMUP_ON_STARTUP = os.environ.get("MODEL_WARMUP_ON_STARTUP", "True").lower() == "true"
+MODEL_LOADING_MAX_WAIT = int(os.environ.get("MODEL_LOADING_MAX_WAIT", 120))
+MODEL_LOADING_TIMEOUT = int(os.environ.get("MODEL_LOADING_TIMEOUT", 600))
+MODEL_LOADING_RETRIES = int(os.environ.get("MODEL_LOADING_RETRIES", 2))
+KEEP_WARM_ENABLED = os.environ.get("KEEP_WARM_ENABLED", "False").lower() == "true"
+KEEP_WARM_HOURS = os.environ.get("KEEP_WARM_HOURS", "8-19")  # ore locali, estremi inclusi
+KEEP_WARM_DAYS = os.environ.get("KEEP_WARM_DAYS", "0-4")  # 0 = lunedì
+KEEP_WARM_INTERVAL = int(os.environ.get("KEEP_WARM_INTERVAL", 300))
+KEEP_WARM_MIN_INTERVAL = int(os.environ.get("KEEP_WARM_MIN_INTERVAL", 60))
+KEEP_WARM_MAX_INTERVAL = int(os.environ.get("KEEP_WARM_MAX_INTERVAL", 900))
+
+# Configurazione della degradazione adattiva sotto carico
+DEGRADATION_ENABLED = os.environ.get("DEGRADATION_ENABLED", "True").lower() == "true"
+DEGRADATION_QUEUE_THRESHOLDS = os.environ.get("DEGRADATION_QUEUE_THRESHOLDS", "4,8,12,16")
+DEGRADATION_LATENCY_THRESHOLDS = os.environ.get("DEGRADATION_LATENCY_THRESHOLDS", "30,45,60,90")
+DEGRADATION_RECOVERY_SECONDS = int(os.environ.get("DEGRADATION_RECOVERY_SECONDS", 30))
+DEGRADATION_LATENCY_WINDOW = int(os.environ.get("DEGRADATION_LATENCY_WINDOW", 60))
+DEGRADATION_LATENCY_MIN_SAMPLES = int(os.environ.get("DEGRADATION_LATENCY_MIN_SAMPLES", 5))
+
+MODEL_LOADING_MESSAGE = "Il modello è in fase di caricamento, riprova tra qualche secondo."
+OVERLOAD_MESSAGE = "Il servizio è momentaneamente sovraccarico, riprova tra qualche minuto."
+
+def get_inference_url(model=None):
+    """URL dell'API di inferenza per il modello indicato"""
+    return f"https://api-inference.huggingface.co/models/{model or INFERENCE_MODEL}"
+
+def parse_loading_response(response):
+    """Restituisce il tempo stimato di caricamento se la risposta indica un modello in caricamento"""
+    if "loading" not in response.text.lower():
+        return None
+    try:
+        return float(response.json().get("estimated_time", 20.0))
+    except Exception:
+        return 20.0
+
+def ping_model(wait_for_model=False, timeout=10):
+    """Invia una richiesta minima al modello per verificarne lo stato o riscaldarlo"""
+    payload = {
+        "inputs": "Ciao",
+        "parameters": {"max_new_tokens": 1, "return_full_text": False},
+        "options": {"wait_for_model": wait_for_model, "use_cache": False}
+    }
+    try:
+        response = requests.post(get_inference_url(), json=payload, timeout=timeout)
+    except requests.exceptions.RequestException as e:
+        logger.warning(f"Ping del modello fallito: {str(e)}")
+        return "error", None
+    
+    if response.status_code == 200:
+        return "ready", None
+    
+    estimated_time = parse_loading_response(response)
+    if estimated_time is not None:
+        return "loading", estimated_time
+    
+    logger.warning(f"Ping del modello fallito ({response.status_code}): {response.text[:200]}")
+    return "error", None
+
+class ModelWarmState:
+    """Stato di caricamento del modello remoto.
+    
+    Quando il modello è in caricamento le richieste restano in attesa
+    dell'evento ready invece di fallire, mentre un singolo thread interroga
+    il modello finché non diventa disponibile.
+    """
+    
+    def __init__(self):
+        self.state = "unknown"  # unknown, loading, ready, error
+        self.estimated_time = None
+        self.loading_since = None
+        self.last_ready = None
+        self.last_request_time = 0.0
+        self.waiting = 0
+        self.cold_starts = 0
+        self.keep_warm_interval = KEEP_WARM_INTERVAL
+        self.keep_warm_pings = 0
+        self._ready_event = threading.Event()
+        self._ready_event.set()
+        self._lock = threading.Lock()
+        self._waiter_running = False
+    
+    def mark_loading(self, estimated_time=None):
+        with self._lock:
+            if self.state != "loading":
+                self.loading_since = time.time()
+                self.cold_starts += 1
+                logger.warning(f"Modello in caricamento (attesa stimata {estimated_time or 0:.0f} secondi)")
+            self.state = "loading"
+            self.estimated_time = estimated_time
+            self._ready_event.clear()
+            if not self._waiter_running:
+                self._waiter_running = True
+                threading.Thread(target=self._wait_for_model, daemon=True).start()
+    
+    def mark_ready(self):
+        with self._lock:
+            if self.state != "ready":
+                logger.info("Modello pronto")
+            self.state = "ready"
+            self.estimated_time = None
+            self.loading_since = None
+            self.last_ready = time.time()
+            self._ready_event.set()
+    
+    def mark_error(self):
+        with self._lock:
+            self.state = "error"
+            self.estimated_time = None
+            self.loading_since = None
+            # Rilascia le richieste in coda: riproveranno e riceveranno l'errore reale
+            self._ready_event.set()
+    
+    def wait_until_ready(self, timeout):
+        """Attende che il modello sia pronto; restituisce False allo scadere del timeout"""
+        with self._lock:
+            self.waiting += 1
+        try:
+            return self._ready_event.wait(timeout)
+        finally:
+            with self._lock:
+                self.waiting -= 1
+    
+    def remaining_wait(self):
+        """Secondi di attesa stimati prima che il modello sia pronto"""
+        if self.state != "loading" or self.loading_since is None:
+            return None
+        elapsed = time.time() - self.loading_since
+        return max(0.0, (self.estimated_time or 0.0) - elapsed)
+    
+    def _wait_for_model(self):
+        """Interroga il modello finché non termina il caricamento"""
+        deadline = time.time() + MODEL_LOADING_TIMEOUT
+        errors = 0
+        try:
+            while time.time() < deadline:
+                status, estimated_time = ping_model(wait_for_model=True, timeout=MODEL_LOADING_MAX_WAIT)
+                if status == "ready":
+                    self.mark_ready()
+                    return
+                if status == "loading":
+                    self.estimated_time = estimated_time
+                    time.sleep(min(max(estimated_time / 2, 2), 10))
+                    continue
+                errors += 1
+                if errors >= 3:
+                    break
+                time.sleep(5)
+            logger.error("Il modello non è diventato disponibile")
+            self.mark_error()
+        finally:
+            with self._lock:
+                self._waiter_running = False
+    
+    def stats(self):
+        remaining = self.remaining_wait()
+        return {
+            "state": self.state,
+            "estimated_wait": round(remaining, 1) if remaining is not None else None,
+            "waiting_requests": self.waiting,
+            "cold_starts": self.cold_starts,
+            "last_ready": datetime.fromtimestamp(self.last_ready).isoformat() if self.last_ready else None,
+            "keep_warm": {
+                "enabled": KEEP_WARM_ENABLED,
+                "active_now": KEEP_WARM_ENABLED and is_keep_warm_time(datetime.now()),
+                "interval": self.keep_warm_interval,
+                "pings": self.keep_warm_pings
+            }
+        }
+
+model_warm_state = ModelWarmState()
+
+def _parse_range(value):
+    """Converte una stringa "inizio-fine" in una coppia di interi"""
+    start, _, end = value.partition("-")
+    return int(start), int(end or start)
+
+def is_keep_warm_time(now):
+    """Verifica se siamo nell'orario lavorativo configurato per il keep-warm"""
+    first_day, last_day = _parse_range(KEEP_WARM_DAYS)
+    first_hour, last_hour = _parse_range(KEEP_WARM_HOURS)
+    return first_day <= now.weekday() <= last_day and first_hour <= now.hour <= last_hour
+
+def warm_up_model():
+    """Riscalda il modello all'avvio"""
+    logger.info(f"Riscaldamento del modello {INFERENCE_MODEL}")
+    status, estimated_time = ping_model()
+    if status == "ready":
+        model_warm_state.mark_ready()
+    elif status == "loading":
+        model_warm_state.mark_loading(estimated_time)
+
+def keep_warm_loop():
+    """Ping periodico del modello in orario lavorativo con intervallo adattivo.
+    
+    Il ping viene saltato se c'è stato traffico reale nell'ultimo intervallo;
+    l'intervallo si dimezza quando il modello viene trovato freddo e cresce
+    gradualmente quando il modello resta caldo.
+    """
+    while True:
+        interval = model_warm_state.keep_warm_interval
+        time.sleep(interval)
+        
+        if not is_keep_warm_time(datetime.now()):
+            continue
+        if time.time() - model_warm_state.last_request_time < interval:
+            continue
+        if model_warm_state.state == "loading":
+            continue
+        
+        status, estimated_time = ping_model()
+        model_warm_state.keep_warm_pings += 1
+        
+        if status == "loading":
+            model_warm_state.mark_loading(estimated_time)
+            model_warm_state.keep_warm_interval = max(KEEP_WARM_MIN_INTERVAL, interval // 2)
+        elif status == "ready":
+            model_warm_state.mark_ready()
+            model_warm_state.keep_warm_interval = min(KEEP_WARM_MAX_INTERVAL, int(interval * 1.5))
+
+def get_cache_key(prompt, max_tokens=1024, temperature=0.7, model=None):
+    """Chiave della cache delle risposte"""
+    return f"{model or INFERENCE_MODEL}_{prompt}_{max_tokens}_{temperature}"
+
+class InferenceError(EngineError):
+    """Errore restituito dall'API di inferenza"""
+
+class ModelLoadingError(InferenceError):
+    """Il modello è ancora in caricamento"""
+
+def call_inference_api(prompt, model=None, max_tokens=1024, temperature=0.7,
+                       priority=PRIORITY_INTERACTIVE, timeout=None):
+    """Chiama l'API di inferenza di Hugging Face; solleva InferenceError in caso di errore.
+    
+    Il caricamento del modello principale viene gestito mettendo in coda la
+    richiesta; per gli altri modelli viene sollevato ModelLoadingError così che
+    il router possa passare a un altro motore.
+    """
+    model = model or INFERENCE_MODEL
+    is_primary = model == INFERENCE_MODEL
+    cache_key = get_cache_key(prompt, max_tokens, temperature, model)
     
     # Verifica se la risposta è già in cache
     if cache_key in response_cache:
         logger.info("Risposta recuperata dalla cache")
         return response_cache[cache_key]
     
-    try:
-        logger.info(f"Chiamata API di inferenza per il modello {INFERENCE_MODEL}")
-        
-        # Configura l'API
-        API_URL = f"https://api-inference.huggingface.co/models/{INFERENCE_MODEL}"
-        
-        # Prepara il payload - configurato per reasoning
-        payload = {
-            "inputs": prompt,
-            "parameters": {
-                "max_new_tokens": max_tokens,
-                "temperature": temperature,
-                "return_full_text": False,
-                "do_sample": True,
-                "top_p": 0.95
-            }
+    # Se il modello è in caricamento la richiesta resta in coda invece di fallire
+    if is_primary and model_warm_state.state == "loading":
+        logger.info("Modello in caricamento, richiesta in attesa")
+        if not model_warm_state.wait_until_ready(MODEL_LOADING_MAX_WAIT):
+            raise ModelLoadingError(MODEL_LOADING_MESSAGE)
+    
+    logger.info(f"Chiamata API di inferenza per il modello {model}")
+    
+    # Configura l'API
+    API_URL = get_inference_url(model)
+    
+    # Prepara il payload - configurato per reasoning
+    payload = {
+        "inputs": prompt,
+        "parameters": {
+            "max_new_tokens": max_tokens,
+            "temperature": temperature,
+            "return_full_text": False,
+            "do_sample": True,
+            "top_p": 0.95
         }
-        
+    }
+    
+    for attempt in range(MODEL_LOADING_RETRIES + 1):
         # Invia richiesta all'API
-        start_time = time.time()
-        response = requests.post(API_URL, json=payload)
-        elapsed_time = time.time() - start_time
+        with upstream_limiter.slot(priority):
+            start_time = time.time()
+            if is_primary:
+                model_warm_state.last_request_time = start_time
+            response = requests.post(API_URL, json=payload, timeout=timeout)
+            elapsed_time = time.time() - start_time
         
         # Log per debug
         logger.info(f"Risposta ricevuta in {elapsed_time:.2f} secondi")
         
         # Verifica risposta
         if response.status_code == 200:
+            if is_primary:
+                model_warm_state.mark_ready()
+            # Per la degradazione conta solo la durata della chiamata, senza attese
+            degradation_controller.record_latency(elapsed_time)
             result = response.json()
             
             # Estrai il testo generato
@@ -84,43 +430,95 @@ def generate_text_with_inference_api(prompt, max_tokens=1024, temperature=0.7):
                 del response_cache[oldest_key]
             
             return generated_text
-        else:
+        
+        # Verifica se è un errore di modello in caricamento
+        estimated_time = parse_loading_response(response)
+        if estimated_time is None:
             error_message = f"Errore API ({response.status_code}): {response.text}"
             logger.error(error_message)
-            
-            # Verifica se è un errore di modello in caricamento
-            if "loading" in response.text.lower() or "currently loading" in response.text.lower():
-                return "Il modello è in fase di caricamento, riprova tra qualche secondo."
-            
-            return f"Errore: {error_message}"
+            raise InferenceError(error_message)
+        
+        if not is_primary:
+            raise ModelLoadingError(f"Modello {model} in caricamento")
+        
+        # Metti in coda la richiesta finché il modello non è pronto, poi riprova
+        model_warm_state.mark_loading(estimated_time)
+        if not model_warm_state.wait_until_ready(MODEL_LOADING_MAX_WAIT):
+            break
     
+    raise ModelLoadingError(MODEL_LOADING_MESSAGE)
+
+def generate_text_with_inference_api(prompt, max_tokens=1024, temperature=0.7, priority=PRIORITY_INTERACTIVE):
+    """Genera testo usando l'API di inferenza di Hugging Face"""
+    try:
+        return call_inference_api(prompt, max_tokens=max_tokens, temperature=temperature, priority=priority)
+    except ModelLoadingError:
+        return MODEL_LOADING_MESSAGE
+    except InferenceError as e:
+        return f"Errore: {str(e)}"
     except Exception as e:
         logger.error(f"Errore durante la generazione: {str(e)}")
         return f"Si è verificato un errore: {str(e)}"
 
-def answer_query(query, client_id="default"):
-    """Elabora una query e genera una risposta ragionata con contesto"""
-    try:
-        # Inizializza la cronologia se non esiste per questo client
-        if client_id not in conversation_history:
-            conversation_history[client_id] = []
-        
-        # Recupera la cronologia per questo client
-        client_history = conversation_history[client_id]
-        
-        # Formatta il prompt includendo la cronologia
-        formatted_history = ""
-        if client_history:
-            formatted_history = "Cronologia della conversazione:\n"
-            for i, exchange in enumerate(client_history[-3:]):  # Ultimi 3 scambi
-                formatted_history += f"Utente: {exchange['user']}\n"
-                if len(exchange['assistant']) > 150:
-                    formatted_history += f"Assistente: {exchange['assistant'][:150]}...\n\n"
-                else:
-                    formatted_history += f"Assistente: {exchange['assistant']}\n\n"
-        
-        # Crea il prompt con la cronologia e pensiero strutturato
-        prompt = f"""<s>[INST] Sei un esperto di Salesforce che fornisce soluzioni tecniche dettagliate e ragionate.
+def is_inference_cached(prompt, model, max_tokens):
+    """Verifica se la risposta del modello per questo prompt è in cache"""
+    return get_cache_key(prompt, max_tokens, model=model) in response_cache
+
+# Router dei modelli: ogni query va al motore adeguato più veloce
+model_router = ModelRouter()
+model_router.register(HFInferenceEngine(
+    "primary", INFERENCE_MODEL, call_inference_api,
+    is_cached_fn=is_inference_cached,
+    available_fn=lambda: model_warm_state.state != "loading",
+    tier="complex", max_new_tokens=1024, timeout=120, expected_latency=20.0
+))
+if FAST_INFERENCE_MODEL:
+    model_router.register(HFInferenceEngine(
+        "fast", FAST_INFERENCE_MODEL, call_inference_api,
+        is_cached_fn=is_inference_cached,
+        tier="simple", max_new_tokens=384, timeout=30, expected_latency=5.0
+    ))
+if LOCAL_MODEL_PATH:
+    model_router.register(LocalAgentEngine(
+        "local", LOCAL_MODEL_PATH, pipelined=LOCAL_AGENT_PIPELINED,
+        tier="simple", max_new_tokens=512, timeout=120, expected_latency=30.0
+    ))
+if ROUTER_MOCK_ENGINE:
+    model_router.register(MockEngine("mock", tier="complex"))
+
+# Controller della degradazione: riduce il costo di generazione sotto carico
+if DEGRADATION_ENABLED:
+    queue_thresholds = parse_thresholds(DEGRADATION_QUEUE_THRESHOLDS, len(DEGRADATION_LEVELS) - 1)
+    latency_thresholds = parse_thresholds(DEGRADATION_LATENCY_THRESHOLDS, len(DEGRADATION_LEVELS) - 1)
+else:
+    queue_thresholds = latency_thresholds = [float("inf")] * (len(DEGRADATION_LEVELS) - 1)
+degradation_controller = DegradationController(
+    queue_thresholds, latency_thresholds,
+    recovery_seconds=DEGRADATION_RECOVERY_SECONDS,
+    latency_window=DEGRADATION_LATENCY_WINDOW,
+    min_latency_samples=DEGRADATION_LATENCY_MIN_SAMPLES
+)
+
+# Risposte recenti per query simili, usate quando si servono solo risposte in cache.
+# Contiene solo risposte generate senza cronologia, che non dipendono dal client
+semantic_cache = SemanticAnswerCache()
+
+def build_prompt(query, client_history, history_exchanges=3):
+    """Costruisce il prompt includendo la cronologia e il pensiero strutturato"""
+    # Formatta il prompt includendo la cronologia
+    formatted_history = ""
+    recent_history = client_history[-history_exchanges:] if history_exchanges > 0 else []
+    if recent_history:
+        formatted_history = "Cronologia della conversazione:\n"
+        for i, exchange in enumerate(recent_history):  # Ultimi scambi
+            formatted_history += f"Utente: {exchange['user']}\n"
+            if len(exchange['assistant']) > 150:
+                formatted_history += f"Assistente: {exchange['assistant'][:150]}...\n\n"
+            else:
+                formatted_history += f"Assistente: {exchange['assistant']}\n\n"
+    
+    # Crea il prompt con la cronologia e pensiero strutturato
+    return f"""<s>[INST] Sei un esperto di Salesforce che fornisce soluzioni tecniche dettagliate e ragionate.
 
 {formatted_history}
 L'utente ha appena chiesto: {query}
@@ -139,25 +537,119 @@ La tua risposta deve essere completa, ben ragionata e seguire le best practices
 RISPONDI SEMPRE IN ITALIANO, anche quando fornisci esempi di codice.
 
 Ricorda di tenere conto della cronologia della conversazione per contestualizzare la tua risposta. [/INST]"""
+
+def build_route_request(query, client_history, priority=PRIORITY_INTERACTIVE, settings=DEGRADATION_LEVELS[0]):
+    """Prepara la richiesta per il router applicando le impostazioni del livello di degradazione"""
+    prompt = build_prompt(query, client_history, settings["history_exchanges"])
+    return RouteRequest(
+        query, prompt,
+        history_length=len(client_history),
+        priority=priority,
+        max_new_tokens=settings["max_new_tokens"],
+        skip_retrieval=settings["skip_retrieval"]
+    )
+
+def route_query(request):
+    """Instrada la richiesta verso il motore più adatto"""
+    response, decision = model_router.route(request)
+    logger.info(f"Query instradata su {decision['engine']} (livello {decision['tier']}, "
+                f"{decision['latency']:.2f} secondi{', fallback' if decision['fallback'] else ''})")
+    return response, decision["engine"]
+
+def serve_from_cache(query, client_history, priority):
+    """Livello solo-cache: risposta esatta dalla cache o dalla cache semantica.
+    
+    La risposta esatta può essere stata generata a qualunque livello che
+    interroga il modello, con prompt e limite di token di quel livello: si
+    cercano tutte le varianti, a partire dalla risposta completa.
+    """
+    for settings in DEGRADATION_LEVELS:
+        if settings["cache_only"]:
+            continue
+        request = build_route_request(query, client_history, priority, settings)
+        if model_router.is_cached(request):
+            return route_query(request)
+    # Le risposte a query simili valgono solo per domande senza cronologia
+    if not client_history:
+        response = semantic_cache.lookup(query)
+        if response is not None:
+            return response, "semantic_cache"
+    return None, None
+
+def process_query(query, client_id="default", priority=PRIORITY_INTERACTIVE):
+    """Elabora una query e restituisce la risposta con le informazioni di servizio.
+    
+    Con client_id None la query è trattata senza cronologia (es. query batch).
+    Il livello di degradazione corrente determina quanto lavoro viene speso
+    per generare la risposta. info["error"] è True se la risposta è un
+    messaggio di errore o di sovraccarico invece di una risposta del modello.
+    """
+    # Solo il traffico interattivo conta come coda per la degradazione
+    tracker = degradation_controller.track() if priority == PRIORITY_INTERACTIVE else nullcontext()
+    with tracker:
+        return _process_query(query, client_id, priority)
+
+def _process_query(query, client_id, priority):
+    level = degradation_controller.current_level()
+    settings = degradation_controller.settings(level)
+    info = {"degradation_level": level, "degradation_name": settings["name"], "engine": None, "error": False}
+    
+    try:
+        # Inizializza la cronologia se non esiste per questo client
+        if client_id is not None and client_id not in conversation_history:
+            conversation_history[client_id] = []
+        
+        # Recupera la cronologia per questo client
+        client_history = conversation_history[client_id] if client_id is not None else []
+        
+        request = build_route_request(query, client_history, priority, settings)
         
         # Ottieni risposta
-        response = generate_text_with_inference_api(prompt)
+        if settings["cache_only"]:
+            response, info["engine"] = serve_from_cache(query, client_history, priority)
+            if response is None:
+                degradation_controller.record_response(level)
+                info["error"] = True
+                return OVERLOAD_MESSAGE, info
+        else:
+            response, info["engine"] = route_query(request)
+            if not client_history:
+                semantic_cache.add(query, response)
         
-        # Aggiorna la cronologia
-        client_history.append({
-            "user": query,
-            "assistant": response
-        })
+        degradation_controller.record_response(level)
         
-        # Limita la lunghezza della cronologia (ultimi 5 scambi)
-        if len(client_history) > 5:
-            conversation_history[client_id] = client_history[-5:]
+        if client_id is not None:
+            # Aggiorna la cronologia
+            client_history.append({
+                "user": query,
+                "assistant": response
+            })
+            
+            # Limita la lunghezza della cronologia (ultimi 5 scambi)
+            if len(client_history) > 5:
+                conversation_history[client_id] = client_history[-5:]
         
-        return response
+        return response, info
         
+    except RoutingError as e:
+        logger.error(f"Errore durante l'elaborazione della query: {str(e)}")
+        info["error"] = True
+        if any(isinstance(error, ModelLoadingError) for error in e.errors):
+            return MODEL_LOADING_MESSAGE, info
+        return f"Mi dispiace, si è verificato un errore: {str(e)}", info
     except Exception as e:
         logger.error(f"Errore durante l'elaborazione della query: {str(e)}")
-        return f"Mi dispiace, si è verificato un errore: {str(e)}"
+        info["error"] = True
+        return f"Mi dispiace, si è verificato un errore: {str(e)}", info
+
+def answer_query(query, client_id="default", priority=PRIORITY_INTERACTIVE):
+    """Elabora una query e genera una risposta ragionata con contesto"""
+    return process_query(query, client_id, priority)[0]
+
+def is_query_cached(query, client_id=None):
+    """Verifica se la risposta a una query è già presente in cache"""
+    client_history = conversation_history.get(client_id, []) if client_id is not None else []
+    return model_router.is_cached(build_route_request(query, client_history))
 
 # Endpoint API per query
 @app.post("/query")
@@ -171,8 +663,9 @@ async def query_endpoint(request: QueryRequest):
         
         logger.info(f"Elaborazione query per client {client_id}: {request.query[:50]}...")
         
-        # Elabora la query
-        response = answer_query(request.query, client_id)
+        # Elabora la query in un thread per non bloccare l'event loop
+        loop = asyncio.get_running_loop()
+        response, info = await loop.run_in_executor(None, process_query, request.query, client_id)
         
         elapsed_time = time.time() - start_time
         logger.info(f"Query elaborata in {elapsed_time:.2f} secondi")
@@ -180,7 +673,8 @@ async def query_endpoint(request: QueryRequest):
         return {
             "response": response,
             "status": "success",
-            "processing_time": elapsed_time
+            "processing_time": elapsed_time,
+            "degradation_level": info["degradation_level"]
         }
     except Exception as e:
         logger.error(f"Errore nell'elaborazione della query: {str(e)}")
@@ -190,6 +684,112 @@ async def query_endpoint(request: QueryRequest):
             "error": str(e)
         }
 
+async def run_batch_item(query, client_id, semaphore):
+    """Esegue una singola query batch e ne misura latenza e stato della cache"""
+    start_time = time.time()
+    if client_id is not None:
+        client_id = BATCH_HISTORY_PREFIX + client_id
+    cached = is_query_cached(query, client_id)
+    loop = asyncio.get_running_loop()
+    
+    try:
+        if cached:
+            response, info = await loop.run_in_executor(batch_executor, process_query, query, client_id, PRIORITY_BATCH)
+        else:
+            async with semaphore:
+                response, info = await loop.run_in_executor(batch_executor, process_query, query, client_id, PRIORITY_BATCH)
+        status = "error" if info["error"] else "success"
+    except Exception as e:
+        logger.error(f"Errore nella query batch: {str(e)}")
+        response = f"Si è verificato un errore: {str(e)}"
+        info = {"degradation_level": None}
+        status = "error"
+    
+    return {
+        "response": response,
+        "status": status,
+        "cache": "hit" if cached else "miss",
+        "latency": time.time() - start_time,
+        "degradation_level": info["degradation_level"]
+    }
+
+async def run_batch_group(items, semaphore, results):
+    """Esegue in sequenza le query di uno stesso client per mantenere la cronologia coerente.
+    
+    Ogni risultato viene messo in results appena pronto, senza attendere il resto del gruppo.
+    """
+    for query, client_id in items:
+        await results.put(((query, client_id), await run_batch_item(query, client_id, semaphore)))
+
+# Endpoint API per query batch
+@app.post("/query/batch")
+async def batch_query_endpoint(request: BatchQueryRequest):
+    """Endpoint per query batch: risultati in streaming NDJSON man mano che sono pronti"""
+    if not request.queries:
+        raise HTTPException(status_code=400, detail="Nessuna query fornita")
+    if len(request.queries) > BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=400, detail=f"Massimo {BATCH_MAX_ITEMS} query per batch")
+    
+    concurrency = min(max(1, request.concurrency or BATCH_CONCURRENCY), BATCH_MAX_CONCURRENCY)
+    
+    # Deduplica le query mantenendo gli indici originali
+    indices = {}
+    for index, item in enumerate(request.queries):
+        key = (item.query.strip(), item.client_id)
+        indices.setdefault(key, []).append(index)
+    
+    # Le query senza client sono indipendenti, quelle dello stesso client vanno in sequenza
+    groups = []
+    client_groups = {}
+    for key in indices:
+        if key[1] is None:
+            groups.append([key])
+        else:
+            if key[1] not in client_groups:
+                client_groups[key[1]] = []
+                groups.append(client_groups[key[1]])
+            client_groups[key[1]].append(key)
+    
+    logger.info(f"Query batch: {len(request.queries)} query, {len(indices)} uniche, concorrenza {concurrency}")
+    
+    async def stream_results():
+        start_time = time.time()
+        semaphore = asyncio.Semaphore(concurrency)
+        summary = {"total": len(request.queries), "unique": len(indices), "cache_hits": 0, "errors": 0}
+        
+        results = asyncio.Queue()
+        tasks = [asyncio.ensure_future(run_batch_group(group, semaphore, results)) for group in groups]
+        try:
+            for _ in range(len(indices)):
+                key, result = await results.get()
+                summary["cache_hits"] += result["cache"] == "hit"
+                summary["errors"] += result["status"] == "error"
+                for position, index in enumerate(indices[key]):
+                    line = {
+                        "index": index,
+                        "query": key[0],
+                        "client_id": key[1],
+                        "deduplicated": position > 0,
+                        **result
+                    }
+                    yield json.dumps(line, ensure_ascii=False) + "\n"
+        finally:
+            for task in tasks:
+                task.cancel()
+        
+        summary["elapsed"] = time.time() - start_time
+        yield json.dumps({"summary": summary}) + "\n"
+    
+    return StreamingResponse(stream_results(), media_type="application/x-ndjson")
+
+# Endpoint per il prefetch speculativo (ricerca e download anticipati della documentazione)
+@app.post("/prefetch")
+async def prefetch_endpoint(request: PrefetchRequest):
+    """Avvia ricerca e download delle pagine prima che arrivi la query vera e propria"""
+    loop = asyncio.get_running_loop()
+    engines = await loop.run_in_executor(None, model_router.prefetch, request.query)
+    return {"prefetching": bool(engines), "engines": engines}
+
 # Endpoint per verificare lo stato
 @app.get("/status")
 async def status_endpoint():
@@ -199,9 +799,22 @@ async def status_endpoint():
         "model": INFERENCE_MODEL,
         "type": "inference_api",
         "cache_size": len(response_cache),
-        "active_conversations": len(conversation_history)
+        "active_conversations": len(conversation_history),
+        "upstream": upstream_limiter.stats(),
+        "model_state": model_warm_state.stats(),
+        "router": model_router.status(),
+        "degradation": degradation_controller.stats(),
+        "semantic_cache": semantic_cache.stats()
     }
 
+# Riscaldamento del modello all'avvio e keep-warm opzionale
+@app.on_event("startup")
+async def start_model_warmup():
+    if MODEL_WARMUP_ON_STARTUP:
+        threading.Thread(target=warm_up_model, daemon=True).start()
+    if KEEP_WARM_ENABLED:
+        threading.Thread(target=keep_warm_loop, daemon=True).start()
+
 # Interfaccia Gradio semplificata senza la distinzione tra tipi di risposta
 with gr.Blocks(title="Salesforce Assistant") as demo:
     gr.Markdown("# Assistente Salesforce")
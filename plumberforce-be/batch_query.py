@@ -0,0 +1,81 @@
+"""Client a riga di comando per l'endpoint /query/batch.
+
+Legge le query da un file di testo (una per riga) oppure JSONL
+({"query": ..., "client_id": ...}) e stampa i risultati NDJSON man mano che
+arrivano dal server.
+
+Uso:
+    python batch_query.py domande.txt [--url http://localhost:7860] [--concurrency 4] [--output risultati.jsonl]
+"""
+import sys
+import json
+import argparse
+
+import requests
+
+
+def load_queries(path):
+    """Carica le query da un file di testo o JSONL"""
+    queries = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            if path.endswith(".jsonl"):
+                item = json.loads(line)
+                queries.append({"query": item["query"], "client_id": item.get("client_id")})
+            else:
+                queries.append({"query": line, "client_id": None})
+    return queries
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Invia query batch all'assistente Salesforce")
+    parser.add_argument("input", help="File con le query (.txt una per riga oppure .jsonl)")
+    parser.add_argument("--url", default="http://localhost:7860", help="URL base del backend")
+    parser.add_argument("--concurrency", type=int, default=None, help="Numero massimo di query concorrenti")
+    parser.add_argument("--output", default=None, help="File NDJSON in cui salvare i risultati")
+    parser.add_argument("--timeout", type=int, default=3600)
+    args = parser.parse_args()
+
+    queries = load_queries(args.input)
+    if not queries:
+        print("Nessuna query trovata")
+        return 1
+
+    payload = {"queries": queries}
+    if args.concurrency:
+        payload["concurrency"] = args.concurrency
+
+    output = open(args.output, "w", encoding="utf-8") if args.output else None
+    try:
+        with requests.post(f"{args.url.rstrip('/')}/query/batch", json=payload,
+                           stream=True, timeout=args.timeout) as response:
+            response.raise_for_status()
+            for line in response.iter_lines(decode_unicode=True):
+                if not line:
+                    continue
+                if output:
+                    output.write(line + "\n")
+                result = json.loads(line)
+                if "summary" in result:
+                    summary = result["summary"]
+                    print(f"Completate {summary['total']} query ({summary['unique']} uniche, "
+                          f"{summary['cache_hits']} dalla cache, {summary['errors']} errori) "
+                          f"in {summary['elapsed']:.2f} secondi")
+                else:
+                    print(f"[{result['index']}] {result['status']} cache={result['cache']} "
+                          f"{result['latency']:.2f}s - {result['query'][:60]}")
+    except requests.exceptions.RequestException as e:
+        print(f"Errore nella richiesta batch: {e}")
+        return 1
+    finally:
+        if output:
+            output.close()
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,114 @@
+"""Benchmark dell'estrazione del contenuto delle pagine di documentazione.
+
+Confronta il percorso originale (download completo + albero BeautifulSoup) con
+l'estrazione in streaming di extract_page_content, su pagine Salesforce salvate
+in locale e servite da un piccolo server HTTP.
+
+Uso:
+    python benchmark_fetch_page.py percorso/pagine_salvate [--runs 5] [--max-length 5000]
+"""
+import os
+import sys
+import time
+import argparse
+import threading
+import tracemalloc
+import functools
+from http.server import HTTPServer, SimpleHTTPRequestHandler
+
+import requests
+from bs4 import BeautifulSoup
+
+from salesforce_agent_minimal import extract_page_content, MAIN_SELECTORS
+
+
+def legacy_fetch_page_content(session, url, max_length=5000):
+    """Percorso originale: scarica tutta la pagina e costruisce l'albero completo"""
+    response = session.get(url, timeout=10)
+    soup = BeautifulSoup(response.text, "html.parser")
+
+    for tag in soup.select("script, style, header, footer, nav"):
+        tag.decompose()
+
+    title = soup.title.get_text(strip=True) if soup.title else ""
+
+    content = ""
+    for selector in MAIN_SELECTORS:
+        if content:
+            break
+        main_content = soup.select_one(selector)
+        if main_content:
+            content = main_content.get_text(separator=" ", strip=True)
+
+    if not content:
+        content = soup.body.get_text(separator=" ", strip=True) if soup.body else ""
+
+    return {"title": title, "url": url, "content": content[:max_length]}
+
+
+class QuietHandler(SimpleHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+def start_server(directory):
+    """Avvia un server HTTP locale che serve le pagine salvate"""
+    handler = functools.partial(QuietHandler, directory=directory)
+    server = HTTPServer(("127.0.0.1", 0), handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+
+def measure(fetch, session, url, max_length, runs):
+    """Restituisce tempo medio (ms), picco di memoria (KB) e risultato"""
+    elapsed = 0.0
+    peak = 0
+    result = None
+    for _ in range(runs):
+        tracemalloc.start()
+        start_time = time.perf_counter()
+        result = fetch(session, url, max_length=max_length)
+        elapsed += time.perf_counter() - start_time
+        peak = max(peak, tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+    return elapsed / runs * 1000, peak / 1024, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark estrazione pagine di documentazione")
+    parser.add_argument("pages_dir", help="Cartella con pagine HTML salvate")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--max-length", type=int, default=5000)
+    args = parser.parse_args()
+
+    pages = sorted(f for f in os.listdir(args.pages_dir) if f.endswith((".html", ".htm")))
+    if not pages:
+        print(f"Nessuna pagina HTML trovata in {args.pages_dir}")
+        return 1
+
+    server = start_server(args.pages_dir)
+    base_url = f"http://127.0.0.1:{server.server_address[1]}"
+    session = requests.Session()
+
+    print(f"{'pagina':<40} {'KB':>8} {'legacy ms':>10} {'stream ms':>10} {'legacy KB':>10} {'stream KB':>10} {'uguale':>7}")
+    totals = [0.0, 0.0, 0.0, 0.0]
+    try:
+        for page in pages:
+            url = f"{base_url}/{page}"
+            size_kb = os.path.getsize(os.path.join(args.pages_dir, page)) / 1024
+            legacy_ms, legacy_kb, legacy = measure(legacy_fetch_page_content, session, url, args.max_length, args.runs)
+            stream_ms, stream_kb, stream = measure(extract_page_content, session, url, args.max_length, args.runs)
+            same = legacy["content"] == stream["content"]
+            totals = [t + v for t, v in zip(totals, (legacy_ms, stream_ms, legacy_kb, stream_kb))]
+            print(f"{page[:40]:<40} {size_kb:>8.0f} {legacy_ms:>10.1f} {stream_ms:>10.1f} {legacy_kb:>10.0f} {stream_kb:>10.0f} {str(same):>7}")
+    finally:
+        server.shutdown()
+
+    count = len(pages)
+    print(f"{'media':<40} {'':>8} {totals[0] / count:>10.1f} {totals[1] / count:>10.1f} {totals[2] / count:>10.0f} {totals[3] / count:>10.0f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
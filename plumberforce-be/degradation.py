@@ -0,0 +1,190 @@
+import re
+import time
+import threading
+from collections import deque, OrderedDict
+from contextlib import contextmanager
+
+# Degradazione adattiva del costo di generazione in base al carico
+
+# Livelli di degradazione: ogni livello include le riduzioni dei precedenti
+DEGRADATION_LEVELS = [
+    {"name": "normal", "max_new_tokens": None, "history_exchanges": 3, "skip_retrieval": False, "cache_only": False},
+    {"name": "short_answers", "max_new_tokens": 512, "history_exchanges": 3, "skip_retrieval": False, "cache_only": False},
+    {"name": "trimmed_history", "max_new_tokens": 384, "history_exchanges": 1, "skip_retrieval": False, "cache_only": False},
+    {"name": "no_retrieval", "max_new_tokens": 256, "history_exchanges": 1, "skip_retrieval": True, "cache_only": False},
+    {"name": "cache_only", "max_new_tokens": 256, "history_exchanges": 1, "skip_retrieval": True, "cache_only": True},
+]
+
+# Parole ignorate nel confronto tra query per la cache semantica
+STOPWORDS = {
+    "il", "lo", "la", "i", "gli", "le", "un", "uno", "una", "di", "da", "in", "con", "su", "per",
+    "tra", "fra", "e", "o", "a", "che", "come", "cosa", "è", "del", "della", "dei", "delle", "al",
+    "alla", "nel", "nella", "posso", "si", "mi", "ci", "salesforce", "the", "a", "an", "of", "to",
+    "in", "how", "what", "is", "and", "or"
+}
+
+
+def parse_thresholds(value, count):
+    """Converte "4,8,12,16" in una lista di soglie crescenti, una per livello oltre il normale"""
+    thresholds = [float(v) for v in value.split(",") if v.strip()]
+    if len(thresholds) != count:
+        raise ValueError(f"Servono {count} soglie, ricevute {len(thresholds)}: {value}")
+    return thresholds
+
+
+class DegradationController:
+    """Sceglie il livello di degradazione in base a coda e latenza recente.
+
+    La latenza recente è la mediana (latency_percentile) delle chiamate al
+    modello nell'ultima latency_window, considerata solo con almeno
+    min_latency_samples misure: una singola richiesta lenta non basta.
+    Il livello sale subito fino a quello indicato dalla coda, ma di un solo
+    livello per valutazione a causa della latenza; scende di un livello alla
+    volta dopo recovery_seconds senza pressione, per evitare oscillazioni.
+    Il tempo trascorso a ogni livello viene accumulato.
+    """
+
+    def __init__(self, queue_thresholds, latency_thresholds, recovery_seconds=30, latency_window=60,
+                 min_latency_samples=5, latency_percentile=0.5, levels=DEGRADATION_LEVELS):
+        self.levels = levels
+        self.queue_thresholds = queue_thresholds
+        self.latency_thresholds = latency_thresholds
+        self.recovery_seconds = recovery_seconds
+        self.latency_window = latency_window
+        self.min_latency_samples = min_latency_samples
+        self.latency_percentile = latency_percentile
+        self.level = 0
+        self.in_flight = 0
+        self.latencies = deque()
+        self.level_since = time.time()
+        self.last_change = self.level_since
+        self.seconds_at_level = [0.0] * len(levels)
+        self.responses_at_level = [0] * len(levels)
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def track(self):
+        """Conta una richiesta in corso per tutta la durata del blocco"""
+        with self._lock:
+            self.in_flight += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+
+    def record_latency(self, latency):
+        """Registra la durata di una chiamata al modello (senza attese in coda o di caricamento)"""
+        with self._lock:
+            self.latencies.append((time.time(), latency))
+
+    def record_response(self, level):
+        with self._lock:
+            self.responses_at_level[level] += 1
+
+    def _recent_latency(self, now):
+        while self.latencies and now - self.latencies[0][0] > self.latency_window:
+            self.latencies.popleft()
+        if len(self.latencies) < self.min_latency_samples:
+            return 0.0
+        latencies = sorted(latency for _, latency in self.latencies)
+        return latencies[int(self.latency_percentile * (len(latencies) - 1))]
+
+    def _target_level(self, now):
+        """Livello richiesto dalla coda e livello richiesto dalla latenza recente"""
+        latency = self._recent_latency(now)
+        queue_target = 0
+        for index, threshold in enumerate(self.queue_thresholds):
+            if self.in_flight >= threshold:
+                queue_target = index + 1
+        latency_target = 0
+        for index, threshold in enumerate(self.latency_thresholds):
+            if latency >= threshold:
+                latency_target = index + 1
+        return queue_target, latency_target
+
+    def _set_level(self, level, now):
+        self.seconds_at_level[self.level] += now - self.level_since
+        self.level = level
+        self.level_since = now
+        self.last_change = now
+
+    def current_level(self):
+        """Aggiorna e restituisce il livello corrente"""
+        with self._lock:
+            now = time.time()
+            queue_target, latency_target = self._target_level(now)
+            target = max(queue_target, min(latency_target, self.level + 1))
+            if target > self.level:
+                self._set_level(target, now)
+            elif target < self.level and now - self.last_change >= self.recovery_seconds:
+                self._set_level(self.level - 1, now)
+            return self.level
+
+    def settings(self, level):
+        return self.levels[level]
+
+    def stats(self):
+        level = self.current_level()
+        with self._lock:
+            now = time.time()
+            seconds = list(self.seconds_at_level)
+            seconds[self.level] += now - self.level_since
+            return {
+                "level": level,
+                "name": self.levels[level]["name"],
+                "queue_depth": self.in_flight,
+                "recent_latency": round(self._recent_latency(now), 3),
+                "seconds_at_level": {l["name"]: round(s, 1) for l, s in zip(self.levels, seconds)},
+                "responses_at_level": {l["name"]: n for l, n in zip(self.levels, self.responses_at_level)},
+                "queue_thresholds": self.queue_thresholds,
+                "latency_thresholds": self.latency_thresholds
+            }
+
+
+class SemanticAnswerCache:
+    """Cache delle risposte per query simili (somiglianza di Jaccard tra parole chiave)"""
+
+    def __init__(self, max_size=200, min_similarity=0.6):
+        self.max_size = max_size
+        self.min_similarity = min_similarity
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _tokens(query):
+        words = re.findall(r"\w+", query.lower())
+        return frozenset(w for w in words if w not in STOPWORDS and len(w) > 1)
+
+    def add(self, query, response):
+        tokens = self._tokens(query)
+        if not tokens:
+            return
+        with self._lock:
+            self.entries[tokens] = response
+            self.entries.move_to_end(tokens)
+            if len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def lookup(self, query):
+        """Restituisce la risposta della query più simile, se abbastanza simile"""
+        tokens = self._tokens(query)
+        best_score = 0.0
+        best_response = None
+        with self._lock:
+            if tokens:
+                for cached_tokens, response in self.entries.items():
+                    score = len(tokens & cached_tokens) / len(tokens | cached_tokens)
+                    if score > best_score:
+                        best_score = score
+                        best_response = response
+            if best_score >= self.min_similarity:
+                self.hits += 1
+                return best_response
+            self.misses += 1
+            return None
+
+    def stats(self):
+        return {"size": len(self.entries), "hits": self.hits, "misses": self.misses}
@@ -0,0 +1,386 @@
+import re
+import time
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+
+# Router delle query verso più motori di inferenza (modelli HF, modello locale, mock)
+
+# Livelli di complessità delle query, dal più semplice al più complesso
+TIERS = ["trivial", "simple", "complex"]
+
+# Token massimi da generare per livello di complessità, applicati solo ai motori
+# più piccoli (tier inferiore a complex): il modello principale usa il proprio limite
+TIER_MAX_NEW_TOKENS = {
+    "trivial": 128,
+    "simple": 384,
+    "complex": 1024
+}
+
+# Messaggi di cortesia che non richiedono un modello grande
+TRIVIAL_PATTERN = re.compile(
+    r"^(grazie( mille)?|ok|okay|perfetto|ottimo|capito|ciao|salve|buongiorno|buonasera|"
+    r"va bene|thanks|thank you|bene|chiaro)[\s!.?]*$",
+    re.IGNORECASE
+)
+
+# Domande definitorie brevi
+SIMPLE_KEYWORDS = [
+    "cos'è", "cosa è", "che cos", "cosa significa", "significa", "definizione",
+    "differenza tra", "qual è", "quali sono", "what is", "difference between"
+]
+
+# Richieste che richiedono ragionamento o generazione di codice
+COMPLEX_KEYWORDS = [
+    "come ", "how ", "codice", "code", "esempio", "implementa", "crea", "scrivi", "genera",
+    "integrazione", "integration", "architettura", "progetta", "ottimizza", "migrazione",
+    "test class", "debug", "errore", "error"
+]
+
+SIMPLE_MAX_WORDS = 15
+
+# Parametri per statistiche e fallback
+LATENCY_EWMA_ALPHA = 0.3
+CIRCUIT_FAILURE_THRESHOLD = 3
+CIRCUIT_COOLDOWN = 60
+
+
+class EngineError(Exception):
+    """Errore di un motore di inferenza: il router passa al motore successivo"""
+
+
+class RoutingError(EngineError):
+    """Tutti i motori candidati hanno fallito"""
+
+    def __init__(self, message, errors):
+        super().__init__(message)
+        self.errors = errors
+
+
+class RouteRequest:
+    """Richiesta da instradare verso un motore di inferenza"""
+
+    def __init__(self, query, prompt, history_length=0, priority=0, max_new_tokens=None,
+                 skip_retrieval=False):
+        self.query = query
+        self.prompt = prompt
+        self.history_length = history_length
+        self.priority = priority
+        # Limite aggiuntivo ai token generati (es. per degradazione sotto carico)
+        self.max_new_tokens = max_new_tokens
+        self.skip_retrieval = skip_retrieval
+
+
+class InferenceEngine:
+    """Motore di inferenza base.
+
+    tier indica il livello di complessità massimo che il motore gestisce in modo
+    adeguato; expected_latency è la latenza stimata prima di avere misure reali.
+    Le sottoclassi implementano generate(request, max_new_tokens) sollevando
+    EngineError in caso di errore o se la generazione supera timeout secondi.
+    """
+
+    def __init__(self, name, tier="complex", max_new_tokens=1024, timeout=120,
+                 expected_latency=10.0, slow_threshold=None):
+        self.name = name
+        self.tier = tier
+        self.max_new_tokens = max_new_tokens
+        self.timeout = timeout
+        self.expected_latency = expected_latency
+        self.slow_threshold = slow_threshold or timeout / 2
+
+    def available(self):
+        """False se il motore è temporaneamente sconsigliato (es. modello in caricamento)"""
+        return True
+
+    def is_cached(self, request, max_new_tokens):
+        """True se la risposta a questa richiesta è già in cache"""
+        return False
+
+    def prefetch(self, query):
+        """Avvia in anticipo il lavoro preparatorio per la query; False se non supportato"""
+        return False
+
+    def details(self):
+        """Informazioni aggiuntive specifiche del motore per /status"""
+        return {}
+
+
+class HFInferenceEngine(InferenceEngine):
+    """Modello servito dall'API di inferenza di Hugging Face"""
+
+    def __init__(self, name, model, generate_fn, is_cached_fn=None, available_fn=None, **kwargs):
+        super().__init__(name, **kwargs)
+        self.model = model
+        self.generate_fn = generate_fn
+        self.is_cached_fn = is_cached_fn
+        self.available_fn = available_fn
+
+    def available(self):
+        return self.available_fn() if self.available_fn else True
+
+    def is_cached(self, request, max_new_tokens):
+        if not self.is_cached_fn:
+            return False
+        return self.is_cached_fn(request.prompt, self.model, max_new_tokens)
+
+    def generate(self, request, max_new_tokens):
+        return self.generate_fn(
+            request.prompt,
+            model=self.model,
+            max_tokens=max_new_tokens,
+            priority=request.priority,
+            timeout=self.timeout
+        )
+
+
+class LocalAgentEngine(InferenceEngine):
+    """Modello locale SalesforceLocalAI, caricato al primo utilizzo"""
+
+    def __init__(self, name, model_path, pipelined=True, **kwargs):
+        super().__init__(name, **kwargs)
+        self.model_path = model_path
+        self.pipelined = pipelined
+        self.agent = None
+        self._lock = threading.Lock()
+        # La generazione locale non ha un timeout proprio: gira in un thread separato
+        # e il router smette di attenderla dopo timeout secondi
+        self.executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix=f"engine-{name}")
+
+    def get_agent(self):
+        with self._lock:
+            if self.agent is None:
+                from salesforce_agent_minimal import SalesforceLocalAI
+                self.agent = SalesforceLocalAI(model_path=self.model_path, pipelined=self.pipelined)
+            return self.agent
+
+    def prefetch(self, query):
+        # Solo se il modello è già caricato: il prefetch non deve avviarne il caricamento
+        if self.agent is None:
+            return False
+        return self.agent.prefetch(query)
+
+    def details(self):
+        return {
+            "loaded": self.agent is not None,
+            "pipelined": self.pipelined,
+            "last_timings": self.agent.last_timings if self.agent else None
+        }
+
+    def generate(self, request, max_new_tokens):
+        try:
+            agent = self.get_agent()
+        except Exception as e:
+            raise EngineError(f"Modello locale non disponibile: {e}")
+
+        future = self.executor.submit(agent.answer_question, request.query, max_tokens=max_new_tokens,
+                                      skip_retrieval=request.skip_retrieval)
+        try:
+            response = future.result(timeout=self.timeout)
+        except FutureTimeoutError:
+            future.cancel()
+            raise EngineError(f"Timeout del modello locale dopo {self.timeout} secondi")
+        if response.startswith("Si è verificato un errore"):
+            raise EngineError(response)
+        return response
+
+
+class MockEngine(InferenceEngine):
+    """Motore finto per i test: risposta fissa, latenza e errori configurabili"""
+
+    def __init__(self, name="mock", response="Risposta di prova.", latency=0.0, fail=False, **kwargs):
+        kwargs.setdefault("expected_latency", latency)
+        super().__init__(name, **kwargs)
+        self.response = response
+        self.latency = latency
+        self.fail = fail
+
+    def generate(self, request, max_new_tokens):
+        time.sleep(self.latency)
+        if self.fail:
+            raise EngineError("Errore simulato")
+        return self.response
+
+
+class EngineStats:
+    """Statistiche di latenza ed errori di un motore"""
+
+    def __init__(self, expected_latency):
+        self.requests = 0
+        self.errors = 0
+        self.slow = 0
+        self.consecutive_failures = 0
+        self.latency_ewma = expected_latency
+        self.measured = False
+        self.last_error = None
+        self.circuit_open_until = 0.0
+
+    def record_success(self, latency, slow_threshold):
+        self.requests += 1
+        self.consecutive_failures = 0
+        if latency > slow_threshold:
+            self.slow += 1
+        if self.measured:
+            self.latency_ewma = LATENCY_EWMA_ALPHA * latency + (1 - LATENCY_EWMA_ALPHA) * self.latency_ewma
+        else:
+            self.latency_ewma = latency
+            self.measured = True
+
+    def record_failure(self, error, latency):
+        self.requests += 1
+        self.errors += 1
+        self.consecutive_failures += 1
+        self.last_error = str(error)[:200]
+        # Un motore che fallisce sembra anche più lento
+        self.latency_ewma = max(self.latency_ewma, latency)
+        if self.consecutive_failures >= CIRCUIT_FAILURE_THRESHOLD:
+            self.circuit_open_until = time.time() + CIRCUIT_COOLDOWN
+
+    def circuit_open(self):
+        return time.time() < self.circuit_open_until
+
+    def to_dict(self):
+        return {
+            "requests": self.requests,
+            "errors": self.errors,
+            "slow": self.slow,
+            "latency_ewma": round(self.latency_ewma, 3),
+            "circuit_open": self.circuit_open(),
+            "last_error": self.last_error
+        }
+
+
+class ModelRouter:
+    """Classifica le query e le instrada verso il motore adeguato più veloce.
+
+    Se il motore scelto fallisce o va in timeout si passa al candidato
+    successivo; i motori che falliscono ripetutamente vengono esclusi per
+    CIRCUIT_COOLDOWN secondi.
+    """
+
+    def __init__(self):
+        self.engines = []
+        self.stats = {}
+        self.decisions = {}
+        self.recent_decisions = deque(maxlen=20)
+        self._lock = threading.Lock()
+
+    def register(self, engine):
+        self.engines.append(engine)
+        self.stats[engine.name] = EngineStats(engine.expected_latency)
+
+    def classify(self, request):
+        """Classificazione economica della query per lunghezza, cronologia e parole chiave"""
+        text = request.query.strip().lower()
+        words = text.split()
+
+        if TRIVIAL_PATTERN.match(text):
+            return "trivial"
+        if len(words) > SIMPLE_MAX_WORDS:
+            return "complex"
+        if any(keyword in text for keyword in COMPLEX_KEYWORDS):
+            return "complex"
+        if any(keyword in text for keyword in SIMPLE_KEYWORDS):
+            return "simple"
+        # Follow-up brevi: la cronologia fornisce il contesto
+        if request.history_length and len(words) <= 6:
+            return "simple"
+        return "complex"
+
+    def candidates(self, tier):
+        """Motori adeguati al livello, ordinati per disponibilità e latenza"""
+        level = TIERS.index(tier)
+        adequate = [e for e in self.engines if TIERS.index(e.tier) >= level]
+
+        def sort_key(engine):
+            stats = self.stats[engine.name]
+            return (stats.circuit_open() or not engine.available(), stats.latency_ewma)
+
+        return sorted(adequate, key=sort_key)
+
+    def max_new_tokens(self, engine, tier, request):
+        limit = engine.max_new_tokens
+        if TIERS.index(engine.tier) < TIERS.index("complex"):
+            limit = min(limit, TIER_MAX_NEW_TOKENS[tier])
+        if request.max_new_tokens:
+            limit = min(limit, request.max_new_tokens)
+        return limit
+
+    def prefetch(self, query):
+        """Avvia il prefetch speculativo solo sul motore che riceverebbe la query"""
+        request = RouteRequest(query, "")
+        candidates = self.candidates(self.classify(request))
+        if candidates and candidates[0].prefetch(query):
+            return [candidates[0].name]
+        return []
+
+    def is_cached(self, request):
+        """True se il primo motore scelto ha già la risposta in cache"""
+        tier = self.classify(request)
+        candidates = self.candidates(tier)
+        if not candidates:
+            return False
+        engine = candidates[0]
+        return engine.is_cached(request, self.max_new_tokens(engine, tier, request))
+
+    def route(self, request):
+        """Genera la risposta; restituisce (risposta, decisione di routing)"""
+        tier = self.classify(request)
+        candidates = self.candidates(tier)
+        if not candidates:
+            raise EngineError(f"Nessun motore registrato per il livello {tier}")
+
+        attempts = []
+        errors = []
+        for engine in candidates:
+            max_new_tokens = self.max_new_tokens(engine, tier, request)
+            cached = engine.is_cached(request, max_new_tokens)
+            start_time = time.time()
+            try:
+                response = engine.generate(request, max_new_tokens)
+            except Exception as e:
+                latency = time.time() - start_time
+                with self._lock:
+                    self.stats[engine.name].record_failure(e, latency)
+                attempts.append({"engine": engine.name, "error": str(e)[:200], "latency": latency})
+                errors.append(e)
+                continue
+
+            latency = time.time() - start_time
+            decision = {
+                "tier": tier,
+                "engine": engine.name,
+                "max_new_tokens": max_new_tokens,
+                "cached": cached,
+                "fallback": bool(attempts),
+                "failed_engines": [a["engine"] for a in attempts],
+                "latency": latency
+            }
+            with self._lock:
+                # Le risposte dalla cache non rappresentano la latenza del motore
+                if not cached:
+                    self.stats[engine.name].record_success(latency, engine.slow_threshold)
+                key = f"{tier}:{engine.name}"
+                self.decisions[key] = self.decisions.get(key, 0) + 1
+                self.recent_decisions.append({"query": request.query[:50], **decision})
+            return response, decision
+
+        raise RoutingError("Tutti i motori hanno fallito: " +
+                           "; ".join(f"{a['engine']}: {a['error']}" for a in attempts), errors)
+
+    def status(self):
+        with self._lock:
+            return {
+                "engines": {
+                    engine.name: {
+                        "tier": engine.tier,
+                        "max_new_tokens": engine.max_new_tokens,
+                        "available": engine.available(),
+                        **self.stats[engine.name].to_dict(),
+                        **engine.details()
+                    }
+                    for engine in self.engines
+                },
+                "decisions": dict(self.decisions),
+                "recent_decisions": list(self.recent_decisions)
+            }
@@ -1,25 +1,402 @@
 import os
 import re
+import copy
 import time
 import json
+import codecs
+import threading
 import requests
+from html.parser import HTMLParser
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse, parse_qs
 from typing import List, Dict, Any, Optional
-from bs4 import BeautifulSoup
 from datetime import datetime
 
 # Versione minimalista dell'agente Salesforce ottimizzata per Hugging Face Spaces
 
+# Limiti per il download delle pagine di documentazione
+MAX_PAGE_BYTES = int(os.environ.get("MAX_PAGE_BYTES", 2 * 1024 * 1024))
+PAGE_CHUNK_SIZE = 16 * 1024
+SEARCH_CHUNK_SIZE = 2 * 1024
+
+# Prefetch speculativo: durata e numero massimo delle ricerche anticipate
+# (oltre il massimo viene sostituita la più vecchia)
+PREFETCH_TTL = int(os.environ.get("PREFETCH_TTL", 120))
+PREFETCH_MAX_ENTRIES = 8
+
+# Istruzioni statiche all'inizio di ogni prompt (pre-codificate una sola volta)
+PROMPT_PREFIX = "Sei un assistente esperto di Salesforce che risponde a domande tecniche."
+
+# Selettori del contenuto principale, in ordine di priorità
+MAIN_SELECTORS = [
+    "article", ".article", "main", "#main", ".docs", ".doc-content",
+    ".content", ".documentation", "#content"
+]
+
+# Tag il cui testo non fa parte del contenuto
+SKIPPED_TAGS = {"script", "style", "header", "footer", "nav"}
+
+# Tag HTML senza tag di chiusura
+VOID_TAGS = {
+    "area", "base", "br", "col", "embed", "hr", "img", "input",
+    "link", "meta", "param", "source", "track", "wbr"
+}
+
+
+def _selector_matches(selector, tag, attrs):
+    """Verifica se un selettore semplice (tag, .classe, #id) corrisponde al tag"""
+    if selector.startswith("."):
+        classes = (attrs.get("class") or "").split()
+        return selector[1:] in classes
+    if selector.startswith("#"):
+        return attrs.get("id") == selector[1:]
+    return tag == selector
+
+
+class MainContentExtractor(HTMLParser):
+    """Parser HTML incrementale che raccoglie titolo e testo del contenuto principale.
+    
+    Emula select_one() sui MAIN_SELECTORS: per ogni selettore raccoglie il testo
+    del primo elemento corrispondente. Il parsing viene interrotto appena il
+    contenuto è definitivo o un contenitore ha raccolto max_length caratteri
+    (vedi _update_done).
+    
+    Il testo può arrivare spezzato a metà parola (HTMLParser passa a ogni feed()
+    il testo ricevuto fino a quel momento): i frammenti vengono uniti e ripuliti
+    solo ai confini dei tag, come i nodi di testo di BeautifulSoup.
+    """
+    
+    def __init__(self, max_length=5000):
+        super().__init__(convert_charrefs=True)
+        self.max_length = max_length
+        self.title_parts = []
+        self.body_parts = []
+        self.body_length = 0
+        # Testo raccolto per ciascun selettore (None = elemento non ancora trovato)
+        self.candidates = [None] * len(MAIN_SELECTORS)
+        self.candidate_lengths = [0] * len(MAIN_SELECTORS)
+        self.open_candidates = set()
+        # Stack dei tag aperti: (tag, indici dei selettori aperti da questo tag)
+        self.stack = []
+        self.skip_depth = 0
+        self.in_title = False
+        self.in_body = False
+        self.done = False
+        # Frammenti del nodo di testo corrente
+        self.pending_text = []
+    
+    def handle_starttag(self, tag, attrs):
+        self._flush_text()
+        if tag in VOID_TAGS:
+            return
+        attrs = dict(attrs)
+        opened = []
+        if tag in SKIPPED_TAGS:
+            self.skip_depth += 1
+        elif tag == "title":
+            self.in_title = True
+        elif tag == "body":
+            self.in_body = True
+        if not self.skip_depth:
+            for index, selector in enumerate(MAIN_SELECTORS):
+                if self.candidates[index] is None and _selector_matches(selector, tag, attrs):
+                    self.candidates[index] = []
+                    self.open_candidates.add(index)
+                    opened.append(index)
+        self.stack.append((tag, opened))
+    
+    def handle_startendtag(self, tag, attrs):
+        # Gli elementi auto-chiusi non contengono testo ma separano i nodi di testo
+        self._flush_text()
+    
+    def handle_comment(self, data):
+        self._flush_text()
+    
+    def handle_endtag(self, tag):
+        self._flush_text()
+        # Chiudi fino al tag corrispondente (tollera HTML malformato)
+        if not any(open_tag == tag for open_tag, _ in self.stack):
+            return
+        while self.stack:
+            open_tag, opened = self.stack.pop()
+            self.open_candidates.difference_update(opened)
+            if open_tag in SKIPPED_TAGS:
+                self.skip_depth -= 1
+            elif open_tag == "title":
+                self.in_title = False
+            if open_tag == tag:
+                break
+        self._update_done()
+    
+    def _is_final(self, index):
+        """True se il testo del selettore non può più cambiare o è già sufficiente"""
+        return bool(self.candidates[index]) and (
+            index not in self.open_candidates or self.candidate_lengths[index] >= self.max_length
+        )
+    
+    def _update_done(self):
+        """Segna il parsing come concluso.
+        
+        Il parsing termina quando il primo selettore in ordine di priorità con
+        testo è definitivo, oppure quando un qualsiasi contenitore ha raggiunto
+        max_length. In questo secondo caso un selettore più prioritario che
+        comparirebbe più avanti nella pagina viene ignorato: rispetto a
+        select_one() si rinuncia alla parità esatta sulle pagine anomale per non
+        dover leggere tutta la pagina.
+        """
+        if any(length >= self.max_length for length in self.candidate_lengths):
+            self.done = True
+            return
+        for index, parts in enumerate(self.candidates):
+            if parts is None:
+                return
+            if self._is_final(index):
+                self.done = True
+                return
+            if index in self.open_candidates:
+                return
+    
+    def handle_data(self, data):
+        self.pending_text.append(data)
+    
+    def close(self):
+        super().close()
+        self._flush_text()
+    
+    def _flush_text(self):
+        """Elabora il nodo di testo completo accumulato fino al tag corrente"""
+        if not self.pending_text:
+            return
+        text = "".join(self.pending_text).strip()
+        self.pending_text = []
+        if not text:
+            return
+        if self.in_title:
+            self.title_parts.append(text)
+            return
+        if self.skip_depth:
+            return
+        for index in self.open_candidates:
+            self.candidates[index].append(text)
+            self.candidate_lengths[index] += len(text) + 1
+        if self.open_candidates:
+            self._update_done()
+        if self.in_body and self.body_length < self.max_length:
+            self.body_parts.append(text)
+            self.body_length += len(text) + 1
+    
+    @property
+    def title(self):
+        return " ".join(self.title_parts)
+    
+    @property
+    def content(self):
+        # Primo selettore (in ordine di priorità) con contenuto, altrimenti il body;
+        # se il parsing è stato interrotto si ignorano i selettori ancora incompleti
+        for index, parts in enumerate(self.candidates):
+            if parts and (not self.done or self._is_final(index)):
+                return " ".join(parts)[:self.max_length]
+        return " ".join(self.body_parts)[:self.max_length]
+
+
+class SearchResultExtractor(HTMLParser):
+    """Parser incrementale dei risultati HTML di DuckDuckGo.
+    
+    Ogni risultato viene aggiunto a completed appena termina il suo snippet
+    (o inizia il successivo), così da poter avviare il download delle pagine
+    prima che l'intera risposta della ricerca sia stata letta.
+    """
+    
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.completed = []
+        self.current = None
+        # Campo di testo in cattura e profondità dei tag aperti al suo interno
+        self.capture = None
+        self.capture_depth = 0
+    
+    def _end_capture(self):
+        # Il testo catturato arriva a frammenti: si normalizzano gli spazi solo alla fine
+        if self.capture and self.current is not None:
+            self.current[self.capture] = " ".join(self.current[self.capture].split())
+        self.capture = None
+    
+    def _finish_current(self):
+        if self.current and self.current["title"] and self.current["url"]:
+            self.completed.append(self.current)
+        self.current = None
+    
+    def handle_starttag(self, tag, attrs):
+        if self.capture and tag not in VOID_TAGS:
+            self.capture_depth += 1
+            return
+        attrs = dict(attrs)
+        classes = (attrs.get("class") or "").split()
+        if "result" in classes:
+            self._finish_current()
+            self.current = {"title": "", "url": "", "snippet": ""}
+        if self.current is None:
+            return
+        if "result__url" in classes:
+            self.current["url"] = attrs.get("href", "")
+        if tag in VOID_TAGS:
+            return
+        if "result__title" in classes:
+            self.capture, self.capture_depth = "title", 1
+        elif "result__snippet" in classes:
+            self.capture, self.capture_depth = "snippet", 1
+    
+    def handle_endtag(self, tag):
+        if self.capture:
+            self.capture_depth -= 1
+            if self.capture_depth <= 0:
+                # Lo snippet è l'ultimo campo del risultato
+                capture = self.capture
+                self._end_capture()
+                if capture == "snippet":
+                    self._finish_current()
+    
+    def handle_data(self, data):
+        if self.capture and self.current is not None:
+            self.current[self.capture] += data
+    
+    def close(self):
+        super().close()
+        self._end_capture()
+        self._finish_current()
+
+
+def iter_available_content(response, chunk_size):
+    """Itera sul corpo della risposta restituendo i dati appena disponibili.
+    
+    iter_content attende di riempire ogni blocco; read1 (urllib3 2.x)
+    restituisce invece quello che è già arrivato.
+    """
+    raw = response.raw
+    if not hasattr(raw, "read1"):
+        yield from response.iter_content(chunk_size=chunk_size)
+        return
+    while True:
+        chunk = raw.read1(chunk_size, decode_content=True)
+        if not chunk:
+            break
+        yield chunk
+
+
+def resolve_result_url(url):
+    """Estrae l'URL reale dai link di reindirizzamento di DuckDuckGo"""
+    if "uddg=" in url:
+        target = parse_qs(urlparse(url).query).get("uddg")
+        if target:
+            return target[0]
+    if url.startswith("//"):
+        return "https:" + url
+    return url
+
+
+class StageTimer:
+    """Registra inizio e fine delle fasi di una richiesta per misurarne la sovrapposizione"""
+    
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.stages = {}
+        self._lock = threading.Lock()
+    
+    def run(self, name, func, *args, **kwargs):
+        """Esegue func registrando la durata della fase"""
+        stage_start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            self.record(name, stage_start, time.perf_counter())
+    
+    def record(self, name, stage_start, stage_end):
+        with self._lock:
+            self.stages[name] = (stage_start - self.start, stage_end - self.start)
+    
+    def report(self):
+        """Durata di ogni fase, tempo totale e tempo risparmiato grazie alla sovrapposizione"""
+        total = time.perf_counter() - self.start
+        with self._lock:
+            stages = {
+                name: {"start": round(start, 3), "end": round(end, 3), "duration": round(end - start, 3)}
+                for name, (start, end) in sorted(self.stages.items(), key=lambda item: item[1][0])
+            }
+        sum_of_stages = sum(stage["duration"] for stage in stages.values())
+        return {
+            "stages": stages,
+            "total": round(total, 3),
+            "sum_of_stages": round(sum_of_stages, 3),
+            "overlap": round(max(0.0, sum_of_stages - total), 3)
+        }
+
+
+def extract_page_content(session, url, max_length=5000, max_bytes=MAX_PAGE_BYTES):
+    """Scarica una pagina in streaming ed estrai titolo e contenuto principale.
+    
+    Il download si interrompe quando sono stati letti max_bytes oppure quando il
+    contenuto principale ha raggiunto max_length caratteri. I contenuti non HTML
+    vengono scartati senza scaricare il corpo della risposta.
+    """
+    try:
+        with session.get(url, timeout=10, stream=True) as response:
+            content_type = response.headers.get("Content-Type", "").lower()
+            if content_type and "html" not in content_type:
+                print(f"Contenuto non HTML ignorato ({content_type}): {url}")
+                return {"title": "", "url": url, "content": ""}
+            
+            decoder = codecs.getincrementaldecoder(response.encoding or "utf-8")(errors="replace")
+            extractor = MainContentExtractor(max_length=max_length)
+            bytes_read = 0
+            
+            for chunk in response.iter_content(chunk_size=PAGE_CHUNK_SIZE):
+                if not chunk:
+                    continue
+                chunk = chunk[:max_bytes - bytes_read]
+                bytes_read += len(chunk)
+                extractor.feed(decoder.decode(chunk))
+                if extractor.done or bytes_read >= max_bytes:
+                    break
+            
+            extractor.feed(decoder.decode(b"", final=True))
+            # Svuota il testo ancora nel buffer del parser
+            extractor.close()
+            
+            return {
+                "title": extractor.title,
+                "url": url,
+                "content": extractor.content
+            }
+    
+    except Exception as e:
+        print(f"Errore nell'estrazione del contenuto: {e}")
+        return {"title": "", "url": url, "content": ""}
+
+
 class SalesforceLocalAI:
     """Agente Salesforce estremamente ottimizzato per spazi limitati"""
     
     def __init__(self, model_path="TinyLlama/TinyLlama-1.1B-Chat-v1.0", 
-                 quantize=True, load_in_4bit=True, use_minimal_memory=True):
+                 quantize=True, load_in_4bit=True, use_minimal_memory=True, pipelined=False):
         """Inizializza l'agente con impostazioni di risparmio memoria"""
         self.model_path = model_path
         self.quantize = quantize
         self.load_in_4bit = load_in_4bit
         self.use_minimal_memory = use_minimal_memory
         
+        # Esecuzione in pipeline: ricerca, download e codifica del prompt in parallelo
+        self.pipelined = pipelined
+        self.stage_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="agent-stage")
+        self.fetch_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="agent-fetch")
+        # Il lavoro speculativo ha thread propri per non rallentare le richieste reali
+        self.prefetch_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="agent-prefetch")
+        self.prefetch_fetch_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="agent-prefetch-fetch")
+        self.prefetched = {}
+        self.prefetch_lock = threading.Lock()
+        self.prefix_state = None
+        self.prefix_lock = threading.Lock()
+        self.last_timings = None
+        
         # Per verifiche di memoria
         self.last_memory_check = time.time()
         
@@ -82,9 +459,15 @@ class SalesforceLocalAI:
             "percent": process.memory_percent()
         }
     
-    def generate(self, prompt, max_tokens=512, temperature=0.7):
-        """Genera testo usando il modello caricato"""
+    def generate(self, prompt, max_tokens=512, temperature=0.7, prefix_state=None):
+        """Genera testo usando il modello caricato.
+        
+        prefix_state (da encode_prompt_prefix) evita di ricalcolare la parte
+        statica iniziale del prompt.
+        """
         try:
+            import torch
+            
             # Format prompt for the model
             formatted_prompt = f"<s>[INST] {prompt} [/INST]"
             
@@ -96,18 +479,40 @@ class SalesforceLocalAI:
                 self.last_memory_check = current_time
             
             # Generate text
-            inputs = self.tokenizer(formatted_prompt, return_tensors="pt").to(self.model.device)
+            generate_kwargs = {
+                "max_new_tokens": max_tokens,
+                "temperature": temperature,
+                "do_sample": True if temperature > 0 else False,
+                "top_p": 0.95,
+                "pad_token_id": self.tokenizer.eos_token_id
+            }
             
-            # Use model.generate() with minimal parameters
-            with torch.no_grad():  # Disable gradient calculation
-                outputs = self.model.generate(
-                    inputs.input_ids,
-                    max_new_tokens=max_tokens,
-                    temperature=temperature,
-                    do_sample=True if temperature > 0 else False,
-                    top_p=0.95,
-                    pad_token_id=self.tokenizer.eos_token_id
-                )
+            input_ids = None
+            if prefix_state and formatted_prompt.startswith(prefix_state["text"]):
+                # Riusa token e cache della parte statica, codifica solo il resto
+                rest_ids = self.tokenizer(
+                    formatted_prompt[len(prefix_state["text"]):],
+                    add_special_tokens=False,
+                    return_tensors="pt"
+                ).input_ids.to(self.model.device)
+                input_ids = torch.cat([prefix_state["input_ids"], rest_ids], dim=-1)
+                try:
+                    with torch.no_grad():
+                        outputs = self.model.generate(
+                            input_ids,
+                            past_key_values=copy.deepcopy(prefix_state["past_key_values"]),
+                            **generate_kwargs
+                        )
+                except Exception as e:
+                    print(f"Cache del prefisso non utilizzabile, generazione completa: {e}")
+                    input_ids = None
+            
+            if input_ids is None:
+                inputs = self.tokenizer(formatted_prompt, return_tensors="pt").to(self.model.device)
+                
+                # Use model.generate() with minimal parameters
+                with torch.no_grad():  # Disable gradient calculation
+                    outputs = self.model.generate(inputs.input_ids, **generate_kwargs)
             
             # Decode response
             response = self.tokenizer.decode(outputs[0], skip_special_tokens=True)
@@ -123,111 +528,65 @@ class SalesforceLocalAI:
             print(f"Errore nella generazione: {e}")
             return f"Si è verificato un errore: {str(e)}"
     
-    def search_documentation(self, query, num_results=3):
-        """Cerca documentazione Salesforce con approccio minimo"""
+    def iter_search_results(self, query, num_results=3):
+        """Cerca documentazione Salesforce restituendo i risultati man mano che arrivano"""
         formatted_query = f"{query} salesforce documentation"
         
         # Usa DuckDuckGo invece di API a pagamento
-        ddg_url = f"https://html.duckduckgo.com/html/?q={formatted_query}"
+        ddg_url = "https://html.duckduckgo.com/html/"
         
-        try:
-            response = self.session.get(ddg_url, timeout=10)
-            soup = BeautifulSoup(response.text, "html.parser")
+        found = 0
+        with self.session.get(ddg_url, params={"q": formatted_query}, timeout=10, stream=True) as response:
+            decoder = codecs.getincrementaldecoder(response.encoding or "utf-8")(errors="replace")
+            extractor = SearchResultExtractor()
             
-            # Estrai risultati
-            results = []
-            for result in soup.select(".result"):
-                title_elem = result.select_one(".result__title")
-                url_elem = result.select_one(".result__url")
-                snippet_elem = result.select_one(".result__snippet")
-                
-                if not title_elem or not url_elem:
-                    continue
-                
-                title = title_elem.get_text(strip=True)
-                url = url_elem.get("href", "")
-                snippet = snippet_elem.get_text(strip=True) if snippet_elem else ""
-                
-                # Verifica che sia un dominio Salesforce
-                if any(domain in url for domain in self.salesforce_domains):
-                    results.append({
-                        "title": title,
-                        "url": url,
-                        "snippet": snippet
-                    })
-                
-                if len(results) >= num_results:
-                    break
+            for chunk in iter_available_content(response, SEARCH_CHUNK_SIZE):
+                extractor.feed(decoder.decode(chunk))
+                while extractor.completed:
+                    result = extractor.completed.pop(0)
+                    # Verifica che sia un dominio Salesforce
+                    if any(domain in result["url"] for domain in self.salesforce_domains):
+                        result["url"] = resolve_result_url(result["url"])
+                        yield result
+                        found += 1
+                        if found >= num_results:
+                            return
             
-            return results
-        
+            extractor.feed(decoder.decode(b"", final=True))
+            extractor.close()
+            for result in extractor.completed:
+                if found >= num_results:
+                    return
+                if any(domain in result["url"] for domain in self.salesforce_domains):
+                    result["url"] = resolve_result_url(result["url"])
+                    yield result
+                    found += 1
+    
+    def search_documentation(self, query, num_results=3):
+        """Cerca documentazione Salesforce con approccio minimo"""
+        try:
+            return list(self.iter_search_results(query, num_results))
         except Exception as e:
             print(f"Errore nella ricerca: {e}")
             return []
     
-    def fetch_page_content(self, url, max_length=5000):
-        """Estrai contenuto da una pagina web"""
-        try:
-            response = self.session.get(url, timeout=10)
-            soup = BeautifulSoup(response.text, "html.parser")
-            
-            # Rimuovi elementi non necessari
-            for tag in soup.select("script, style, header, footer, nav"):
-                tag.decompose()
-            
-            # Estrai contenuto
-            title = soup.title.get_text(strip=True) if soup.title else ""
-            
-            # Prova selettori comuni per il contenuto principale
-            main_selectors = [
-                "article", ".article", "main", "#main", ".docs", ".doc-content",
-                ".content", ".documentation", "#content"
-            ]
-            
-            # Estrai il testo
-            content = ""
-            for selector in main_selectors:
-                if content:
-                    break
-                    
-                main_content = soup.select_one(selector)
-                if main_content:
-                    content = main_content.get_text(separator=" ", strip=True)
-            
-            # Se non è stato trovato nulla, prendi il body
-            if not content:
-                content = soup.body.get_text(separator=" ", strip=True) if soup.body else ""
-            
-            # Limita la lunghezza
-            content = content[:max_length]
-            
-            return {
-                "title": title,
-                "url": url,
-                "content": content
-            }
-            
-        except Exception as e:
-            print(f"Errore nell'estrazione del contenuto: {e}")
-            return {"title": "", "url": url, "content": ""}
+    def fetch_page_content(self, url, max_length=5000, max_bytes=MAX_PAGE_BYTES):
+        """Estrai contenuto da una pagina web (in streaming, con limite di byte)"""
+        return extract_page_content(self.session, url, max_length=max_length, max_bytes=max_bytes)
     
-    def answer_question(self, question):
-        """Risponde a una domanda usando il modello con ricerca web"""
-        # Cerca documentazione pertinente
-        docs = self.search_documentation(question)
-        
-        # Estrai contenuto dalle pagine
+    def format_context(self, pages):
+        """Formatta il contenuto delle pagine come contesto del prompt"""
         context = ""
-        if docs:
-            for doc in docs[:2]:  # Limita a 2 documenti per risparmiare memoria
-                page_content = self.fetch_page_content(doc["url"])
-                if page_content["content"]:
-                    context += f"\nTitolo: {page_content['title']}\n"
-                    context += f"URL: {page_content['url']}\n"
-                    context += f"Contenuto: {page_content['content'][:1000]}...\n\n"
-        
-        # Prepara prompt con contesto
-        prompt = f"""Sei un assistente esperto di Salesforce che risponde a domande tecniche.
+        for page_content in pages:
+            if page_content["content"]:
+                context += f"\nTitolo: {page_content['title']}\n"
+                context += f"URL: {page_content['url']}\n"
+                context += f"Contenuto: {page_content['content'][:1000]}...\n\n"
+        return context
+    
+    def build_prompt(self, question, context):
+        """Prepara prompt con contesto"""
+        return f"""{PROMPT_PREFIX}
         
         Contesto dalla documentazione:
         {context if context else "Nessuna documentazione rilevante trovata."}
@@ -235,9 +594,131 @@ class SalesforceLocalAI:
         Domanda: {question}
         
         Fornisci una risposta dettagliata e accurata basata sulle tue conoscenze di Salesforce e sul contesto fornito."""
+    
+    def answer_question(self, question, max_tokens=1024, skip_retrieval=False, pipelined=None):
+        """Risponde a una domanda usando il modello con ricerca web.
+        
+        Con skip_retrieval=True la ricerca e il download delle pagine vengono
+        saltati (usato sotto carico elevato). In modalità pipelined le fasi
+        vengono sovrapposte (vedi _answer_question_pipelined).
+        """
+        if self.pipelined if pipelined is None else pipelined:
+            return self._answer_question_pipelined(question, max_tokens, skip_retrieval)
+        
+        # Cerca documentazione pertinente
+        docs = [] if skip_retrieval else self.search_documentation(question)
+        
+        # Estrai contenuto dalle pagine
+        # Limita a 2 documenti per risparmiare memoria
+        context = self.format_context(self.fetch_page_content(doc["url"]) for doc in docs[:2])
+        
+        prompt = self.build_prompt(question, context)
         
         # Genera risposta
-        response = self.generate(prompt, max_tokens=1024)
+        response = self.generate(prompt, max_tokens=max_tokens)
+        
+        return response
+    
+    def retrieve_context(self, question, timer, num_docs=2, fetch_executor=None):
+        """Ricerca e download in pipeline: ogni pagina viene scaricata appena arriva il risultato"""
+        fetch_executor = fetch_executor or self.fetch_executor
+        fetches = []
+        search_start = time.perf_counter()
+        try:
+            for index, doc in enumerate(self.iter_search_results(question, num_results=num_docs)):
+                fetches.append(fetch_executor.submit(
+                    timer.run, f"fetch_{index + 1}", self.fetch_page_content, doc["url"]
+                ))
+        except Exception as e:
+            print(f"Errore nella ricerca: {e}")
+        finally:
+            timer.record("search", search_start, time.perf_counter())
+        
+        return self.format_context(fetch.result() for fetch in fetches)
+    
+    def encode_prompt_prefix(self):
+        """Tokenizza e codifica (cache KV) le istruzioni statiche iniziali del prompt"""
+        with self.prefix_lock:
+            if self.prefix_state is None:
+                import torch
+                text = f"<s>[INST] {PROMPT_PREFIX}"
+                input_ids = self.tokenizer(text, return_tensors="pt").input_ids.to(self.model.device)
+                with torch.no_grad():
+                    outputs = self.model(input_ids, use_cache=True)
+                self.prefix_state = {
+                    "text": text,
+                    "input_ids": input_ids,
+                    "past_key_values": outputs.past_key_values
+                }
+            return self.prefix_state
+    
+    def prefetch(self, question):
+        """Avvia in anticipo ricerca e download delle pagine per una domanda (es. appena arriva dal WebSocket)"""
+        key = question.strip().lower()
+        now = time.time()
+        with self.prefetch_lock:
+            if key in self.prefetched:
+                return False
+            # Rimuovi le ricerche anticipate scadute e, se necessario, la più vecchia;
+            # quelle non ancora avviate vengono annullate
+            for old_key, (old_future, _, created) in list(self.prefetched.items()):
+                if now - created > PREFETCH_TTL or len(self.prefetched) >= PREFETCH_MAX_ENTRIES:
+                    old_future.cancel()
+                    del self.prefetched[old_key]
+            timer = StageTimer()
+            future = self.prefetch_executor.submit(self.retrieve_context, question, timer,
+                                                   fetch_executor=self.prefetch_fetch_executor)
+            self.prefetched[key] = (future, timer, now)
+        return True
+    
+    def _take_prefetch(self, question):
+        """Restituisce (future, timer) di una ricerca anticipata ancora valida e già avviata"""
+        key = question.strip().lower()
+        with self.prefetch_lock:
+            entry = self.prefetched.pop(key, None)
+        if not entry or time.time() - entry[2] > PREFETCH_TTL:
+            return None, None
+        # Ancora in coda dietro altri prefetch: meglio eseguire subito la ricerca
+        if entry[0].cancel():
+            return None, None
+        return entry[0], entry[1]
+    
+    def _answer_question_pipelined(self, question, max_tokens=1024, skip_retrieval=False):
+        """Esecuzione in pipeline di answer_question.
+        
+        La ricerca (o quella anticipata da prefetch) e i download delle pagine
+        procedono mentre il prefisso statico del prompt viene codificato; la
+        latenza totale si avvicina a quella della fase più lenta. I tempi di
+        ogni fase sono salvati in last_timings.
+        """
+        timer = StageTimer()
+        
+        prefix_future = self.stage_executor.submit(timer.run, "prefix_encoding", self.encode_prompt_prefix)
+        
+        retrieval_future = None
+        prefetch_timer = None
+        if not skip_retrieval:
+            retrieval_future, prefetch_timer = self._take_prefetch(question)
+            if retrieval_future is None:
+                retrieval_future = self.stage_executor.submit(self.retrieve_context, question, timer)
+        
+        context = retrieval_future.result() if retrieval_future else ""
+        prompt = self.build_prompt(question, context)
+        
+        try:
+            prefix_state = prefix_future.result()
+        except Exception as e:
+            print(f"Errore nella codifica del prefisso: {e}")
+            prefix_state = None
+        
+        response = timer.run("generate", self.generate, prompt, max_tokens=max_tokens, prefix_state=prefix_state)
+        
+        self.last_timings = timer.report()
+        if prefetch_timer:
+            self.last_timings["prefetch"] = prefetch_timer.report()
+        print(f"Pipeline completata in {self.last_timings['total']:.2f}s "
+              f"(somma fasi {self.last_timings['sum_of_stages']:.2f}s, "
+              f"sovrapposizione {self.last_timings['overlap']:.2f}s)")
         
         return response
     
@@ -1,15 +1,17 @@
 import os
 import json
 import time
+import asyncio
 import requests
 from typing import List, Optional, Dict, Any
 from fastapi import FastAPI, HTTPException, Request, WebSocket, WebSocketDisconnect
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
-from fastapi.responses import HTMLResponse, JSONResponse
+from fastapi.responses import HTMLResponse, JSONResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 import uvicorn
+from markdown_renderer import MarkdownRenderer
 
 # Configurazione da variabili d'ambiente
 PORT = int(os.environ.get("PORT", 8080))
@@ -20,6 +22,20 @@ API_KEY = os.environ.get("API_KEY", "")  # Per sicurezza tra frontend e backend
 # Aggiungi la nuova variabile d'ambiente in cima al file
 N8N_WEBHOOK_URL = os.environ.get("N8N_WEBHOOK_URL", "")
 
+# Intervallo di controllo dello stato del modello durante l'elaborazione (secondi)
+PROGRESS_POLL_INTERVAL = int(os.environ.get("PROGRESS_POLL_INTERVAL", 5))
+
+# Prefetch speculativo della documentazione sul backend appena arriva una query.
+# Da abilitare solo se il workflow n8n risponde chiamando /query del backend:
+# altrimenti la ricerca anticipata non viene mai usata
+PREFETCH_ENABLED = os.environ.get("PREFETCH_ENABLED", "False").lower() == "true"
+
+# Rendering del markdown lato server per le risposte di /api/query (campo html).
+# La chat WebSocket non lo usa: i suoi messaggi non contengono markdown da mostrare
+SERVER_RENDER_MARKDOWN = os.environ.get("SERVER_RENDER_MARKDOWN", "False").lower() == "true"
+RENDER_CACHE_SIZE = int(os.environ.get("RENDER_CACHE_SIZE", 256))
+RENDER_PYGMENTS_STYLE = os.environ.get("RENDER_PYGMENTS_STYLE", "default")
+
 # Inizializza FastAPI
 app = FastAPI(title="Salesforce AI Assistant Frontend")
 
@@ -46,6 +62,7 @@ class QueryResponse(BaseModel):
     query: str
     response: str
     status: str
+    html: Optional[str] = None
 
 class FeedbackRequest(BaseModel):
     query_id: str
@@ -55,6 +72,14 @@ class FeedbackRequest(BaseModel):
 # Archiviazione in-memory per cronologia conversazioni
 conversation_store = {}
 
+# Renderer markdown condiviso
+renderer = MarkdownRenderer(enabled=SERVER_RENDER_MARKDOWN, cache_size=RENDER_CACHE_SIZE, style=RENDER_PYGMENTS_STYLE)
+
+async def render_markdown(text):
+    """Esegue il rendering in un thread per non bloccare l'event loop"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, renderer.render, text)
+
 # Gestione delle connessioni WebSocket
 class ConnectionManager:
     def __init__(self):
@@ -88,6 +113,11 @@ class ConnectionManager:
         if client_id in self.active_connections:
             await self.active_connections[client_id].send_json(message)
 
+    async def send_transient(self, message: dict, client_id: str):
+        # Messaggi di avanzamento: inviati ma non salvati nella cronologia
+        if client_id in self.active_connections:
+            await self.active_connections[client_id].send_json(message)
+
 manager = ConnectionManager()
 
 # Funzione per chiamare l'API backend
@@ -161,8 +191,10 @@ async def get_status():
                 "status": "online" if backend_ready else "offline",
                 "ready": backend_ready,
                 "error": backend_error,
-                "model": backend_status.get("model", "unknown")
-            }
+                "model": backend_status.get("model", "unknown"),
+                "model_state": backend_status.get("model_state")
+            },
+            "render": renderer.stats()
         }
     except Exception as e:
         return {
@@ -170,6 +202,11 @@ async def get_status():
             "backend": {"status": "error", "error": str(e)}
         }
 
+# Foglio di stile per l'evidenziazione del codice renderizzato lato server
+@app.get("/render/styles.css")
+async def render_styles():
+    return Response(content=renderer.stylesheet(), media_type="text/css")
+
 # Endpoint per il controllo salute
 @app.get("/health")
 async def health_check():
@@ -194,15 +231,47 @@ async def query_agent(request: QueryRequest):
         import uuid
         query_id = str(uuid.uuid4())
         
+        response_text = backend_response.get("response", "")
+        
         return QueryResponse(
             query_id=query_id,
             query=request.query,
-            response=backend_response.get("response", ""),
-            status="success"
+            response=response_text,
+            status="success",
+            html=await render_markdown(response_text)
         )
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+async def report_model_progress(client_id: str):
+    """Invia al client aggiornamenti sullo stato di caricamento del modello"""
+    loop = asyncio.get_running_loop()
+    was_loading = False
+    while True:
+        backend_status = await loop.run_in_executor(None, call_backend_api, "status", None, "GET", 5)
+        model_state = backend_status.get("model_state") or {}
+        
+        if model_state.get("state") == "loading":
+            was_loading = True
+            estimated_wait = model_state.get("estimated_wait")
+            content = "Il modello si sta caricando, la richiesta è in coda"
+            if estimated_wait:
+                content += f" (attesa stimata: circa {int(estimated_wait)} secondi)"
+            await manager.send_transient(
+                {"type": "progress", "state": "loading", "content": content + "...",
+                 "estimated_wait": estimated_wait, "timestamp": time.time()},
+                client_id
+            )
+        elif was_loading:
+            was_loading = False
+            await manager.send_transient(
+                {"type": "progress", "state": "ready", "content": "Modello pronto, elaborazione in corso...",
+                 "timestamp": time.time()},
+                client_id
+            )
+        
+        await asyncio.sleep(PROGRESS_POLL_INTERVAL)
+
 # Modifica questa parte nella gestione WebSocket
 @app.websocket("/ws/{client_id}")
 async def websocket_endpoint(websocket: WebSocket, client_id: str):
@@ -211,6 +280,12 @@ async def websocket_endpoint(websocket: WebSocket, client_id: str):
         while True:
             data = await websocket.receive_json()
             query = data.get("query", "")
+            
+            # Avvia subito ricerca e prefetch sul backend, senza attenderne l'esito
+            if PREFETCH_ENABLED and query:
+                asyncio.get_running_loop().run_in_executor(
+                    None, call_backend_api, "prefetch", {"query": query}, "POST", 5
+                )
 
             # Messaggio utente
             await manager.send_message(
@@ -229,11 +304,20 @@ async def websocket_endpoint(websocket: WebSocket, client_id: str):
                 if not N8N_WEBHOOK_URL:
                     raise Exception("N8N_WEBHOOK_URL non è configurato.")
 
-                n8n_response = requests.post(
-                    N8N_WEBHOOK_URL,
-                    json={"query": query},
-                    timeout=300  # Aumenta il timeout, n8n potrebbe impiegare tempo
-                )
+                # La chiamata gira in un thread mentre si riporta lo stato del modello
+                loop = asyncio.get_running_loop()
+                progress_task = asyncio.ensure_future(report_model_progress(client_id))
+                try:
+                    n8n_response = await loop.run_in_executor(
+                        None,
+                        lambda: requests.post(
+                            N8N_WEBHOOK_URL,
+                            json={"query": query},
+                            timeout=300  # Aumenta il timeout, n8n potrebbe impiegare tempo
+                        )
+                    )
+                finally:
+                    progress_task.cancel()
                 n8n_response.raise_for_status()
                 file_data = n8n_response.json()
 
@@ -0,0 +1,156 @@
+import re
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+
+# Rendering lato server del markdown (opzionale: richiede markdown, pygments e bleach)
+try:
+    import bleach
+    import markdown
+    from pygments.formatters import HtmlFormatter
+    RENDERING_AVAILABLE = True
+except ImportError:
+    RENDERING_AVAILABLE = False
+
+# Estensioni markdown equivalenti alle opzioni di marked (gfm, breaks)
+MARKDOWN_EXTENSIONS = ["fenced_code", "codehilite", "tables", "nl2br", "sane_lists"]
+
+# Blocchi di codice delimitati, con l'eventuale linguaggio indicato
+FENCE_PATTERN = re.compile(
+    r"^(?P<fence>`{3,}|~{3,})[ \t]*(?P<lang>[\w#+.-]*)(?P<rest>[^\n]*)\n(?P<code>.*?)^(?P=fence)[ \t]*$",
+    re.MULTILINE | re.DOTALL
+)
+
+# Linguaggi Salesforce senza lexer Pygments, evidenziati con il lexer più simile
+LANGUAGE_ALIASES = {
+    "apex": "java",
+    "cls": "java",
+    "trigger": "java",
+    "soql": "sql",
+    "sosl": "sql",
+    "visualforce": "html",
+    "vf": "html",
+    "aura": "html",
+    "lwc": "javascript",
+    "sfdx": "bash"
+}
+
+# Euristiche per i blocchi senza linguaggio, in ordine (guess_lexer di Pygments
+# è lento e sbaglia spesso su Apex); in mancanza di corrispondenze resta testo
+LANGUAGE_GUESSES = [
+    ("html", re.compile(r"^\s*<")),
+    ("sql", re.compile(r"^\s*(SELECT|FIND)\b", re.IGNORECASE)),
+    ("bash", re.compile(r"^\s*(\$ |sfdx |sf |npm |git )", re.MULTILINE)),
+    ("json", re.compile(r"^\s*[{\[]\s*\"")),
+    ("python", re.compile(r"^\s*(def \w+\(|import \w+\s*$|from [\w.]+ import )", re.MULTILINE)),
+    ("javascript", re.compile(r"\b(const|let|function)\b|=>|\bexport default\b")),
+    ("java", re.compile(r"[;{}]"))
+]
+
+# Tag e attributi consentiti nell'HTML generato
+ALLOWED_TAGS = [
+    "a", "abbr", "b", "blockquote", "br", "code", "del", "div", "em", "h1", "h2", "h3", "h4",
+    "h5", "h6", "hr", "i", "img", "li", "ol", "p", "pre", "span", "strong", "table", "tbody",
+    "td", "th", "thead", "tr", "ul"
+]
+ALLOWED_ATTRIBUTES = {
+    "*": ["class"],
+    "a": ["href", "title"],
+    "img": ["src", "alt", "title"],
+    "td": ["align"],
+    "th": ["align"]
+}
+ALLOWED_PROTOCOLS = ["http", "https", "mailto"]
+
+
+class MarkdownRenderer:
+    """Converte markdown in HTML sanificato ed evidenziato, con cache LRU per hash del contenuto"""
+
+    def __init__(self, enabled=True, cache_size=256, style="default"):
+        self.enabled = enabled and RENDERING_AVAILABLE
+        self.cache_size = cache_size
+        self.style = style
+        self.cache = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.render_time = 0.0
+        self.max_render_time = 0.0
+        self._lock = threading.Lock()
+
+    def stylesheet(self):
+        """CSS per le classi generate da Pygments"""
+        if not self.enabled:
+            return ""
+        return HtmlFormatter(style=self.style).get_style_defs(".codehilite")
+
+    @staticmethod
+    def _code_language(lang, code):
+        """Linguaggio Pygments per un blocco di codice (alias Salesforce o euristiche)"""
+        if lang:
+            return LANGUAGE_ALIASES.get(lang.lower(), lang)
+        for name, pattern in LANGUAGE_GUESSES:
+            if pattern.search(code):
+                return name
+        return "text"
+
+    def _prepare_fences(self, text):
+        """Indica esplicitamente il linguaggio di ogni blocco di codice prima di codehilite"""
+        def replace(match):
+            lang = self._code_language(match.group("lang"), match.group("code"))
+            return f"{match.group('fence')}{lang}{match.group('rest')}\n{match.group('code')}{match.group('fence')}"
+        return FENCE_PATTERN.sub(replace, text)
+
+    def _render(self, text):
+        html = markdown.markdown(
+            self._prepare_fences(text),
+            extensions=MARKDOWN_EXTENSIONS,
+            extension_configs={"codehilite": {"guess_lang": False}}
+        )
+        return bleach.clean(
+            html,
+            tags=ALLOWED_TAGS,
+            attributes=ALLOWED_ATTRIBUTES,
+            protocols=ALLOWED_PROTOCOLS,
+            strip=True
+        )
+
+    def render(self, text):
+        """Restituisce l'HTML del testo, o None se il rendering è disabilitato"""
+        if not self.enabled or not isinstance(text, str):
+            return None
+
+        key = hashlib.sha256(text.encode("utf-8")).hexdigest()
+        with self._lock:
+            if key in self.cache:
+                self.cache.move_to_end(key)
+                self.hits += 1
+                return self.cache[key]
+
+        start_time = time.perf_counter()
+        try:
+            html = self._render(text)
+        except Exception as e:
+            print(f"Errore nel rendering del markdown: {e}")
+            return None
+        elapsed = time.perf_counter() - start_time
+
+        with self._lock:
+            self.misses += 1
+            self.render_time += elapsed
+            self.max_render_time = max(self.max_render_time, elapsed)
+            self.cache[key] = html
+            if len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+        return html
+
+    def stats(self):
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "cache_size": len(self.cache),
+                "hits": self.hits,
+                "misses": self.misses,
+                "avg_render_ms": round(self.render_time / self.misses * 1000, 2) if self.misses else 0.0,
+                "max_render_ms": round(self.max_render_time * 1000, 2)
+            }
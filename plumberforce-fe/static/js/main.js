@@ -52,8 +52,17 @@ document.addEventListener('DOMContentLoaded', function() {
 			.then(data => {
 				const statusIndicator = document.getElementById('status-indicator');
 				
+				const modelState = data.backend && data.backend.model_state;
+				
 				// Aggiorna la UI in base allo stato del backend
-				if (data.backend && data.backend.ready) {
+				if (modelState && modelState.state === 'loading') {
+					// Modello in caricamento: mostra l'attesa stimata e ricontrolla
+					const wait = modelState.estimated_wait ? ` (~${Math.ceil(modelState.estimated_wait)}s)` : '';
+					statusIndicator.innerHTML = `<span class="spinner-border spinner-border-sm" role="status"></span> Caricamento modello${wait}`;
+					statusIndicator.classList.add('initializing');
+					statusIndicator.classList.remove('ready');
+					setTimeout(checkAgentStatus, 5000);
+				} else if (data.backend && data.backend.ready) {
 					statusIndicator.innerHTML = '<span class="text-success">●</span> Pronto';
 					statusIndicator.classList.remove('initializing');
 					statusIndicator.classList.add('ready');
@@ -170,12 +179,14 @@ function handleWebSocketMessage(message) {
             addUserMessage(message.content);
             break;
         case 'assistant': // Questo caso potrebbe non essere più usato, ma lo lasciamo per compatibilità
+            removeProgressMessage();
             addAssistantMessage(message.content);
             setProcessingState(false);
             showFeedbackCard();
             break;
         // --- INIZIO NUOVO CODICE ---
         case 'file_ready':
+            removeProgressMessage();
             // Funzione per creare un link di download
             createDownloadLink(message.fileName, message.content);
             // Ripristina l'interfaccia
@@ -187,7 +198,12 @@ function handleWebSocketMessage(message) {
         case 'status':
             addStatusMessage(message.content);
             break;
+        case 'progress':
+            // Aggiornamenti transitori (es. modello in caricamento)
+            updateProgressMessage(message.content);
+            break;
         case 'error':
+            removeProgressMessage();
             addErrorMessage(message.content);
             setProcessingState(false);
             break;
@@ -305,6 +321,26 @@ function createDownloadLink(fileName, fileContent) {
         conversation.appendChild(messageDiv);
     }
     
+    // Aggiorna (o crea) il messaggio di avanzamento
+    function updateProgressMessage(content) {
+        let progressDiv = document.getElementById('progress-message');
+        if (!progressDiv) {
+            progressDiv = document.createElement('div');
+            progressDiv.id = 'progress-message';
+            progressDiv.className = 'status-message';
+            conversation.appendChild(progressDiv);
+        }
+        progressDiv.textContent = content;
+    }
+    
+    // Rimuovi il messaggio di avanzamento
+    function removeProgressMessage() {
+        const progressDiv = document.getElementById('progress-message');
+        if (progressDiv) {
+            progressDiv.remove();
+        }
+    }
+    
     // Aggiungi messaggio di errore
     function addErrorMessage(content) {
         const messageDiv = document.createElement('div');